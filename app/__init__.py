@@ -6,8 +6,6 @@ import logging
 
 from flask import got_request_exception, Flask, request
 from flask.ext.babel import Babel
-import rollbar
-import rollbar.contrib.flask
 import yaml
 
 
@@ -49,6 +47,7 @@ INTERMEDIATE_LANGUAGES = ['', 'ja', 'ru']
 DEFAULT_USER_AGENT = 'AndroidTranslate/4.4.0.RC01.104701208-44000162 5.1 ' \
     'tablet GTR_TRANS_WLOPV1_ANDROID GTR_TRANS_WLOPV1_DE_EN_AR'
 MAX_TEXT_LENGTH = 8000
+MAX_LONG_TEXT_LENGTH = 5 * MAX_TEXT_LENGTH
 
 
 try:
@@ -57,6 +56,33 @@ except IOError:
     # FIXME: This is a temporary workaround; use a dummy config object
     config = yaml.load(open('config.yml.dist'))
 
+
+def to_bool(value):
+    """Converts a setting value (e.g., ``'true'`` or ``'0'`` from the
+    environment variables) into a boolean."""
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_config(section, key, default=None, cast=None):
+    """Reads a setting from the environment variables first, then from the
+    config object. For example, ``get_config('upstream', 'pool_maxsize')``
+    looks up ``UPSTREAM_POOL_MAXSIZE`` and then ``config['upstream']
+    ['pool_maxsize']``.
+
+    :param cast: A callable to convert the value (e.g., ``int``)
+    """
+    env_name = '{}_{}'.format(section, key).upper()
+    try:
+        value = os.environ[env_name]
+    except KeyError:
+        value = ((config or {}).get(section) or {}).get(key, default)
+
+    if value is not None and cast is not None:
+        value = cast(value)
+    return value
+
 logger = logging.getLogger('translator')
 handler = logging.StreamHandler(sys.stderr)
 handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
@@ -66,6 +92,23 @@ logger.setLevel(logging.INFO)
 babel = Babel()
 
 
+def create_jinja_bytecode_cache():
+    """Creates a cache of compiled templates shared by all worker processes
+    (and their successors), as configured in the ``jinja`` section, or
+    returns ``None`` if it is disabled."""
+    if not get_config('jinja', 'bytecode_cache', True, to_bool):
+        return None
+
+    from jinja2 import FileSystemBytecodeCache
+
+    # Jinja picks a private directory under the system temporary directory
+    # if none is given
+    directory = get_config('jinja', 'bytecode_cache_dir') or None
+    if directory is not None and not os.path.isdir(directory):
+        os.makedirs(directory)
+    return FileSystemBytecodeCache(directory)
+
+
 def create_app(name=__name__, config={}):
     app = Flask(name)
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_URI')
@@ -74,8 +117,16 @@ def create_app(name=__name__, config={}):
 
     app.config.update(config)
 
-    from app.analysis.model import db
-    db.init_app(app)
+    bytecode_cache = create_jinja_bytecode_cache()
+    if bytecode_cache is not None:
+        app.jinja_options = dict(app.jinja_options,
+                                 bytecode_cache=bytecode_cache)
+
+    # SQLAlchemy and the models take long to import, and nothing but the
+    # data tools (see bin/data.py) needs them
+    if app.config['SQLALCHEMY_DATABASE_URI']:
+        from app.analysis.model import db
+        db.init_app(app)
 
     from app.api import api_module
     from app.main import main_module
@@ -89,6 +140,12 @@ def create_app(name=__name__, config={}):
 
     babel.init_app(app)
 
+    from app.profiling import RequestProfiler
+    app.extensions['profiler'] = RequestProfiler(app)
+
+    from app.capture import TrafficRecorder
+    app.extensions['recorder'] = TrafficRecorder(app)
+
     if app.config['DEBUG']:
         from werkzeug import SharedDataMiddleware
         app.wsgi_app = SharedDataMiddleware(app.wsgi_app, {
@@ -98,6 +155,9 @@ def create_app(name=__name__, config={}):
     @app.before_first_request
     def init_rollbar():
         """init rollbar module"""
+        import rollbar
+        import rollbar.contrib.flask
+
         rollbar.init(
             # access token
             os.environ.get('ROLLBAR_TOKEN', ''),
@@ -114,6 +174,13 @@ def create_app(name=__name__, config={}):
         got_request_exception.connect(rollbar.contrib.flask.report_exception,
                                       app)
 
+    if get_config('aws', 'warm_up', False, to_bool):
+        from app.api import get_lambda_client
+        try:
+            get_lambda_client()
+        except Exception as e:
+            logger.warning('Failed to warm up the Lambda client: {}'.format(e))
+
     if babel.locale_selector_func is None:
         babel.localeselector(get_locale)
 
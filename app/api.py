@@ -1,68 +1,351 @@
 # -*- coding: utf-8 -*-
+import base64
+import gzip
+import hashlib
+import io
 import json
 import operator
 import os
-import random
 import re
 import sys
+import threading
+import time
 import urllib
 import uuid
+from collections import OrderedDict
+
+from flask import Blueprint, g, request, jsonify, Response
+from flask.ext.babel import gettext as _, get_locale
+from requests.exceptions import Timeout as RequestTimeout
+
+from app import config, get_config, to_bool, logger, VALID_LANGUAGES, \
+    SOURCE_LANGUAGES, TARGET_LANGUAGES, INTERMEDIATE_LANGUAGES, \
+    DEFAULT_USER_AGENT, MAX_TEXT_LENGTH, MAX_LONG_TEXT_LENGTH
+from app import metrics
+from app.cache import create_translation_cache, translation_cache
+from app.concurrency import create_hedger, parallel_map, SingleFlight, \
+    unordered_map
+from app.segmentation import join_text, split_sentences, split_text
+from app.upstream import create_circuit_breaker, CircuitOpenError, \
+    Deadline, get_session, is_throttled, load_proxies, ProxySelector, \
+    remaining_time, session_stats, upstream_url
+from app.utils import HTTPException, parse_javascript, \
+    parse_javascript_sections
 
-import requests
-from flask import Blueprint, request, jsonify
-from flask.ext.babel import gettext as _
 
-from app import config, logger, VALID_LANGUAGES, SOURCE_LANGUAGES, \
-    TARGET_LANGUAGES, INTERMEDIATE_LANGUAGES, DEFAULT_USER_AGENT, \
-    MAX_TEXT_LENGTH
-from app.utils import HTTPException, parse_javascript
+api_module = Blueprint('api', __name__)
 
+#: Maximum number of texts in a single batch translation request
+MAX_BATCH_SIZE = 100
 
-api_module = Blueprint('api', __name__)
+#: Seconds a Lambda invocation may take beyond the remaining budget of its
+#: request, for the overhead of invoking the function
+LAMBDA_READ_TIMEOUT_MARGIN = 2.0
+
+#: Read timeouts of the Lambda clients, in seconds. Boto3 does not take a
+#: timeout per invocation, so each invocation goes through the client with
+#: the shortest read timeout that covers its remaining budget (or one with
+#: ``deadline.max`` plus the margin).
+LAMBDA_READ_TIMEOUTS = (3.0, 5.0, 10.0, 20.0)
+
+#: Shares in-flight upstream requests among identical concurrent calls
+upstream_flights = SingleFlight()
+
+_lambda_clients = {}
+_lambda_clients_pid = None
+_lambda_client_lock = threading.Lock()
+
+#: Routes Lambda invocations to the fastest and healthiest web proxies
+proxy_selector = ProxySelector(load_proxies())
+
+#: Send backup requests when upstream requests or Lambda invocations are
+#: unusually slow (``None`` if hedging is disabled)
+upstream_hedger = create_hedger()
+proxy_hedger = create_hedger()
+
+#: Stops hammering Google Translate while it throttles us
+upstream_breaker = create_circuit_breaker()
+
+#: Caches the first leg of mode 2 translations regardless of their final
+#: target languages
+intermediate_cache = create_translation_cache('intermediate')
+
+#: Serialized language lists and their ETags, keyed by everything they
+#: depend on (e.g., the locale selected by Babel)
+language_responses = {}
+
+
+@api_module.before_request
+def start_timer():
+    g.started_at = time.time()
+
+
+@api_module.after_request
+def record_response(resp):
+    """Records the latency and the status code of every API request."""
+    labels = (('endpoint', request.endpoint),)
+    metrics.increment('translator_responses_total',
+                      labels + (('status', str(resp.status_code)),))
+    started_at = getattr(g, 'started_at', None)
+    if started_at is not None:
+        metrics.observe('translator_request_seconds',
+                        time.time() - started_at, labels)
+    return resp
 
 
-def get_lambda_client():
+@metrics.register_collector
+def collect_stats():
+    """Reports the statistics of caches, connection pools, the circuit
+    breaker, request coalescing and hedging as gauges."""
+    gauges = []
+
+    def add(prefix, stats, labels=()):
+        for key, value in stats.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                gauges.append(('{}_{}'.format(prefix, key), labels, value))
+
+    add('translator_cache', translation_cache.stats(),
+        (('cache', 'translation'),))
+    add('translator_cache', intermediate_cache.stats(),
+        (('cache', 'intermediate'),))
+    add('translator_single_flight', upstream_flights.stats())
+
+    breaker_stats = upstream_breaker.stats()
+    add('translator_breaker', breaker_stats)
+    gauges.append(('translator_breaker_open', (),
+                   int(breaker_stats['state'] != upstream_breaker.CLOSED)))
+
+    for name, hedger in (('upstream', upstream_hedger),
+                         ('proxy', proxy_hedger)):
+        if hedger is not None:
+            add('translator_hedge', hedger.stats(), (('target', name),))
+
+    for pool in session_stats():
+        add('translator_upstream_pool', pool, (('host', pool['host']),))
+
+    for proxy in proxy_selector.stats():
+        add('translator_proxy', proxy, (('proxy', proxy['name']),))
+
+    return gauges
+
+
+def create_lambda_client(region=None, read_timeout=None):
     """First attempt to get AWS configuration from the environment variables;
     then try to access the config object if environment variables are not
-    available."""
+    available.
+
+    :param read_timeout: Seconds to wait for an invocation to respond;
+                         defaults to ``deadline.max`` plus
+                         :data:`LAMBDA_READ_TIMEOUT_MARGIN`
+    """
     from boto3.session import Session
+    from botocore.config import Config
     access_key = os.environ.get('AWS_ACCESS_KEY_ID',
                                 config['aws']['access_key'])
     secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY',
                                 config['aws']['secret_key'])
-    region = os.environ.get('AWS_DEFAULT_REGION',
-                            config['aws']['region'])
+    if region is None:
+        region = os.environ.get('AWS_DEFAULT_REGION',
+                                config['aws']['region'])
 
     session = Session(aws_access_key_id=access_key,
                       aws_secret_access_key=secret_key,
                       region_name=region)
 
-    return session.client('lambda')
+    max_pool_connections = get_config('aws', 'max_pool_connections', 10, int)
+    connect_timeout = get_config('aws', 'connect_timeout', 2, float)
+    if read_timeout is None:
+        read_timeout = lambda_read_timeout(None)
+    # e.g., bin/fake_upstream.py standing in for AWS Lambda in load tests
+    endpoint_url = get_config('aws', 'endpoint_url') or None
+    return session.client(
+        'lambda', endpoint_url=endpoint_url,
+        config=Config(max_pool_connections=max_pool_connections,
+                      connect_timeout=connect_timeout,
+                      read_timeout=read_timeout,
+                      # A retry would run past the deadline anyway
+                      retries={'max_attempts': 0}))
+
+
+def lambda_read_timeout(budget):
+    """Returns the read timeout of the Lambda client to use for an
+    invocation that has ``budget`` seconds left (``None`` for no
+    deadline)."""
+    if budget is not None:
+        for read_timeout in LAMBDA_READ_TIMEOUTS:
+            if budget + LAMBDA_READ_TIMEOUT_MARGIN <= read_timeout:
+                return read_timeout
+    return get_config('deadline', 'max', 30, float) + \
+        LAMBDA_READ_TIMEOUT_MARGIN
+
+
+def get_lambda_client(region=None, budget=None):
+    """Returns the process-wide Lambda client for a region (or the default
+    region) and a remaining budget in seconds (see
+    :func:`lambda_read_timeout`). Building a client involves resolving
+    credentials and endpoints, so it is done only once per process. A forked
+    worker builds its own clients rather than sharing the connection pools
+    of its parent."""
+    global _lambda_clients_pid
+
+    key = (region, lambda_read_timeout(budget))
+    pid = os.getpid()
+    if _lambda_clients_pid == pid and key in _lambda_clients:
+        return _lambda_clients[key]
+
+    with _lambda_client_lock:
+        if _lambda_clients_pid != pid:
+            _lambda_clients.clear()
+            _lambda_clients_pid = pid
+        if key not in _lambda_clients:
+            _lambda_clients[key] = create_lambda_client(*key)
+
+    return _lambda_clients[key]
+
+
+def __hedged_invoke_proxy__(payload, deadline=None):
+    """Same as :func:`__invoke_proxy__`, but a slow invocation is hedged with
+    another one through a different proxy if hedging is enabled."""
+    if proxy_hedger is None:
+        return __invoke_proxy__(payload, deadline=deadline)
+
+    primary = proxy_selector.choose()
+    return proxy_hedger.call(
+        lambda: __invoke_proxy__(payload, primary, deadline),
+        lambda: __invoke_proxy__(
+            payload, proxy_selector.choose(exclude=[primary.name]),
+            deadline),
+        timeout=remaining_time(deadline))
+
+
+def __invoke_proxy__(payload, proxy=None, deadline=None):
+    """Invokes a web proxy function (chosen by :data:`proxy_selector` unless
+    given) and records how it went. With a ``deadline``, the web proxy is
+    told how long it may wait for the upstream, and an :class:`HTTPException`
+    (504) is raised if nothing is left of it, either before or after the
+    invocation. The invocation itself goes through a Lambda client whose read
+    timeout covers the remaining budget, rounded up to one of
+    :data:`LAMBDA_READ_TIMEOUTS`, so it may outlast the deadline by that
+    much at worst.
+
+    :return: The decoded response of the function
+    """
+    if proxy is None:
+        proxy = proxy_selector.choose()
+    budget = remaining_time(deadline)
+    if budget is not None:
+        payload = dict(payload, timeout=budget)
+    lambda_client = get_lambda_client(proxy.region, budget)
+
+    started_at = time.time()
+    labels = (('proxy', proxy.name),)
+    try:
+        resp = lambda_client.invoke(
+            FunctionName=proxy.name,
+            InvocationType='RequestResponse',
+            LogType='Tail',
+            Payload=json.dumps(payload)
+        )
+        resp_content = json.loads(resp['Payload'].read().decode('utf-8'))
+    except Exception as e:
+        throttled = 'TooManyRequests' in type(e).__name__ or \
+            'TooManyRequests' in str(e)
+        proxy_selector.record(proxy.name, time.time() - started_at,
+                              error=True, throttled=throttled)
+        metrics.increment('translator_proxy_errors_total', labels)
+        if 'Timeout' in type(e).__name__:
+            raise HTTPException('Request timed out.', 504)
+        raise
+
+    metrics.observe('translator_stage_seconds', time.time() - started_at,
+                    (('stage', 'lambda'),))
+
+    if isinstance(resp_content, dict) and 'responses' in resp_content:
+        status_codes = [r.get('status_code')
+                        for r in resp_content['responses']]
+    elif isinstance(resp_content, dict):
+        status_codes = [resp_content.get('status_code')]
+    else:
+        status_codes = [None]
+
+    proxy_selector.record(
+        proxy.name, time.time() - started_at,
+        error='FunctionError' in resp or
+        any(s is None or s >= 500 for s in status_codes),
+        throttled=any(s in (403, 429, 503) for s in status_codes))
+
+    if 'FunctionError' in resp:
+        raise HTTPException('Web proxy {} failed: {}'.format(
+            proxy.name, resp_content), 502)
+
+    # Nobody is waiting for a response that comes after the deadline
+    remaining_time(deadline)
 
-    import boto3
-    client = boto3.client('lambda')
-    return client
+    return resp_content
 
 
-def lambda_get(url, params={}, data={}, headers={}):
-    """Sends an HTTP GET request via AWS Lambda."""
-    lambda_client = get_lambda_client()
+def __decode_proxy_response__(resp):
+    """Decodes a response that the web proxy compressed with gzip+base64."""
+    if resp.get('encoding') == 'gzip+base64':
+        body = gzip.GzipFile(
+            fileobj=io.BytesIO(base64.b64decode(resp['body']))).read()
+        resp = {'text': body.decode('utf-8'),
+                'status_code': resp['status_code']}
+    return resp
+
 
-    function_names = ['web_proxy', 'web_proxy2']
+def lambda_get(url, params={}, data={}, headers={}, compress=None,
+               deadline=None):
+    """Sends an HTTP GET request via AWS Lambda.
+
+    :param compress: Whether the web proxy compresses the response text.
+                     Defaults to the ``aws.compress`` setting.
+    :type deadline: app.upstream.Deadline
+    :return: A dictionary of ``text`` and ``status_code`` of the response
+    """
+    if compress is None:
+        compress = get_config('aws', 'compress', False, to_bool)
 
     payload = {
         'url': url,
         'params': params,
         'data': data,
         'headers': headers,
+        'compress': compress,
     }
-    resp = lambda_client.invoke(
-        FunctionName=random.choice(function_names),
-        InvocationType='RequestResponse',
-        LogType='Tail',
-        Payload=json.dumps(payload)
-    )
-    return resp
+    return __decode_proxy_response__(
+        __hedged_invoke_proxy__(payload, deadline))
+
+
+def lambda_get_batch(reqs, compress=None, deadline=None):
+    """Sends multiple HTTP GET requests via AWS Lambda. Up to
+    ``aws.max_batch_size`` requests share a single invocation, in which they
+    are sent concurrently.
+
+    :param reqs: A list of dictionaries having ``url`` and optionally
+                 ``params``, ``data`` and ``headers``
+    :return: A list of dictionaries of ``text`` and ``status_code`` (or
+             ``error``) in the order of ``reqs``
+    """
+    if compress is None:
+        compress = get_config('aws', 'compress', False, to_bool)
+
+    max_batch_size = get_config('aws', 'max_batch_size', 25, int)
+    batches = [reqs[i:i + max_batch_size]
+               for i in range(0, len(reqs), max_batch_size)]
+
+    def invoke(batch):
+        payload = {'requests': batch, 'compress': compress}
+        return [__decode_proxy_response__(r)
+                for r in __hedged_invoke_proxy__(
+                    payload, deadline)['responses']]
+
+    max_concurrency = get_config('batch', 'max_concurrency', 8, int)
+    return [resp for responses in parallel_map(invoke, batches,
+                                               max_concurrency)
+            for resp in responses]
 
 
 def __payload_as_tuples__(payload):
@@ -98,7 +381,7 @@ def __params__(text, source, target, client='at',
         # 'otf': 1,
         'ie': 'UTF-8',
     }
-    url = 'https://translate.google.com/translate_a/single'
+    url = upstream_url('/translate_a/single', 'https')
 
     try:
         # Python 3
@@ -124,6 +407,33 @@ def __params__(text, source, target, client='at',
     }
 
 
+def get_deadline():
+    """Creates a :class:`Deadline` for the current request. Clients may ask
+    for another budget (up to ``deadline.max``) in seconds with the
+    ``X-Request-Timeout`` header or the ``timeout`` parameter."""
+    default = get_config('deadline', 'default', 10, float)
+    maximum = get_config('deadline', 'max', 30, float)
+
+    value = request.headers.get('X-Request-Timeout') or \
+        request.values.get('timeout')
+    try:
+        timeout = float(value) if value else default
+    except ValueError:
+        timeout = default
+
+    return Deadline(max(0, min(timeout, maximum)))
+
+
+def is_cache_enabled():
+    """Indicates whether the current route may use the translation cache.
+    Routes are opted out by listing their endpoint names (e.g.,
+    ``api.translate_1_1``) in the ``cache.disabled_routes`` setting."""
+    disabled_routes = get_config('cache', 'disabled_routes') or []
+    if isinstance(disabled_routes, str):
+        disabled_routes = disabled_routes.split(',')
+    return request.endpoint not in disabled_routes
+
+
 def get_languages(field):
     """Returns a list of languages.
 
@@ -164,19 +474,68 @@ def _parse_javascript():
     return jsonify({'parsed': parse_javascript(raw)})
 
 
+#: Top-level sections of a ``client=t`` response that ``parse_result`` can
+#: extract, by name
+RESULT_SECTIONS = {
+    'sentences': 0,
+    'source_language': 2,
+    'phrases': 5,
+    'language_detection': 8,
+}
+
+
 @api_module.route('/api/v1.3/parse_result', methods=['post'])
 def parse_result():
-    """Parses a translation result."""
+    """Parses a translation result.
+
+    :param raw: The raw translation result
+    :param sections: A comma-separated list of sections to extract (see
+                     ``RESULT_SECTIONS``); defaults to ``sentences``. Other
+                     sections are skipped without being parsed.
+    """
     raw = request.form['raw']
-    parsed = parse_javascript(raw)
+    names = request.form.get('sections', 'sentences').split(',')
+
+    try:
+        indices = [RESULT_SECTIONS[name.strip()] for name in names]
+    except KeyError as e:
+        return 'Invalid section: {}'.format(e.args[0]), 400
+
+    parsed = parse_javascript_sections(raw, indices)
+
+    result = {}
+    for name in names:
+        name = name.strip()
+        section = parsed[RESULT_SECTIONS[name]]
+        if name == 'sentences':
+            # Extract translated sentences, filtering out None elements
+            translations = filter(None, [x[0] for x in section or []])
+            result['translated'] = ''.join(translations)
+        else:
+            result[name] = section
+
+    return jsonify(result)
+
 
-    # Extract translated sentences
-    translations = [x[0] for x in parsed[0]]
+def __language_response__(key, build):
+    """Serves a language list that depends on nothing but ``key``. The list
+    is built and serialized only once per process, and is served with a
+    strong ETag so that clients revalidate it with a conditional request.
 
-    # Filter out None elements
-    translations = filter(None, translations)
+    :param build: A function that returns the body to be serialized
+    """
+    try:
+        body, etag = language_responses[key]
+    except KeyError:
+        body = jsonify(build()).get_data()
+        etag = hashlib.sha1(body).hexdigest()
+        language_responses[key] = (body, etag)
 
-    return jsonify({'translated': ''.join(translations)})
+    resp = Response(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = get_config('languages', 'max_age', 3600, int)
+    return resp.make_conditional(request)
 
 
 @api_module.route('/v1.0/languages')
@@ -184,8 +543,11 @@ def parse_result():
 def languages_v1_0():
     """Returns a list of supported languages."""
     locale = request.args['locale']  # noqa
-    langs = {k: _(v) for (k, v) in get_languages('target')}
-    return jsonify(langs)
+
+    def build():
+        return {k: _(v) for (k, v) in get_languages('target')}
+
+    return __language_response__(('v1.0', str(get_locale())), build)
 
 
 @api_module.route('/api/v1.3/languages')
@@ -200,13 +562,17 @@ def languages_v1_3():
     except Exception as e:
         return str(e), 400
 
-    languages = [(x, _(y)) for x, y in languages]
+    def build():
+        translated = [(x, _(y)) for x, y in languages]
 
-    # -1 indicates no sorting
-    if sortby != -1:
-        languages = sorted(languages, key=operator.itemgetter(sortby))
+        # -1 indicates no sorting
+        if sortby != -1:
+            translated = sorted(translated, key=operator.itemgetter(sortby))
 
-    return jsonify({'languages': languages})
+        return {'languages': translated}
+
+    key = ('v1.3', str(get_locale()), field, sortby)
+    return __language_response__(key, build)
 
 
 @api_module.route('/v1.0/translate', methods=['POST'])
@@ -283,7 +649,12 @@ def translate_v1_0():
     text, mode, source, target = map(lambda k: request.form[k].strip(), keys)
 
     try:
-        return jsonify(translate(text, mode, source, target))
+        payload = translate(text, mode, source, target,
+                            use_cache=is_cache_enabled(),
+                            deadline=get_deadline())
+        with metrics.timed('translator_stage_seconds',
+                           (('stage', 'serialize'),)):
+            return jsonify(payload)
 
     except HTTPException as e:
         return e.message, e.status_code
@@ -311,8 +682,12 @@ def translate_1_1():
     text, mode, source, target = map(lambda k: request.form[k].strip(), keys)
 
     try:
-        payload = translate(text, mode, source, target)
-        return jsonify(payload)
+        payload = translate(text, mode, source, target,
+                            use_cache=is_cache_enabled(),
+                            deadline=get_deadline())
+        with metrics.timed('translator_stage_seconds',
+                           (('stage', 'serialize'),)):
+            return jsonify(payload)
 
     except HTTPException as e:
         return e.message, e.status_code
@@ -340,9 +715,12 @@ def translate_1_2():
     text, mode, source, target = map(lambda k: request.form[k].strip(), keys)
 
     try:
-        payload = translate(text, mode, source, target)
-
-        return jsonify(payload)
+        payload = translate(text, mode, source, target,
+                            use_cache=is_cache_enabled(),
+                            deadline=get_deadline())
+        with metrics.timed('translator_stage_seconds',
+                           (('stage', 'serialize'),)):
+            return jsonify(payload)
 
     except HTTPException as e:
         return e.message, e.status_code
@@ -353,11 +731,13 @@ def translate_1_2():
 
 
 def __translate__(text, source, target, client='x',
-                  user_agent=DEFAULT_USER_AGENT):
+                  user_agent=DEFAULT_USER_AGENT, deadline=None):
     """
     text: text to be translated
     source: source language
     target: target language
+    deadline: :class:`app.upstream.Deadline` bounding the upstream request;
+              ``upstream.timeout`` applies if not given
     """
 
     if source == target:
@@ -377,17 +757,59 @@ def __translate__(text, source, target, client='x',
         'tl': target,
         'text': text,
     }
-    url = 'http://translate.google.com/translate_a/t'
+    url = upstream_url('/translate_a/t')
 
-    req = requests.post(url, headers=headers, data=payload)
+    timeout = remaining_time(
+        deadline, get_config('upstream', 'timeout', 10, float))
+    if not upstream_breaker.allow():
+        metrics.increment('translator_upstream_errors_total',
+                          (('status', '503'), ('reason', 'circuit_open')))
+        raise CircuitOpenError()
+
+    started_at = time.time()
+    try:
+        req = get_session().post(url, headers=headers, data=payload,
+                                 timeout=timeout)
+    except RequestTimeout:
+        upstream_breaker.record_failure()
+        metrics.increment('translator_upstream_errors_total',
+                          (('status', '504'), ('reason', 'timeout')))
+        raise HTTPException('Request timed out.', 504)
+    except Exception:
+        upstream_breaker.record_failure()
+        metrics.increment('translator_upstream_errors_total',
+                          (('status', ''), ('reason', 'connection')))
+        raise
+
+    latency = time.time() - started_at
+    metrics.observe('translator_stage_seconds', latency,
+                    (('stage', 'upstream'),))
+    metrics.observe('translator_upstream_seconds', latency,
+                    (('source', source), ('target', target)))
+
+    if is_throttled(req):
+        upstream_breaker.record_failure(throttled=True)
+    elif req.status_code >= 500:
+        upstream_breaker.record_failure()
+    else:
+        upstream_breaker.record_success()
 
     if req.status_code != 200:
+        metrics.increment('translator_upstream_errors_total',
+                          (('status', str(req.status_code)),
+                           ('reason', 'status')))
         raise HTTPException(
             ('Google Translate returned HTTP {}'.format(req.status_code)),
             req.status_code)
 
+    with metrics.timed('translator_stage_seconds', (('stage', 'parse'),)):
+        return __parse_response__(req.text, client)
+
+
+def __parse_response__(text, client):
+    """Parses the response of Google Translate for ``client``."""
     if client == 'x':
-        data = json.loads(req.text)
+        data = json.loads(text)
 
         # It appears in some cases the Google Translate returns a string
         # rather than a dictionary
@@ -409,13 +831,62 @@ def __translate__(text, source, target, client='x',
         return '\n'.join(map(lambda x: x.strip(), result.split('\n')))
 
     elif client == 't':
-        return parse_javascript(req.text)
+        return parse_javascript(text)
 
     else:
         raise Exception("Unsupported client '{}'".format(client))
 
 
-def translate(text, mode, source, target, client='x'):
+def __coalesced_translate__(text, source, target, client='x',
+                            user_agent=DEFAULT_USER_AGENT, deadline=None):
+    """Same as :func:`__translate__`, but concurrent calls for the same text
+    and language pair wait for the upstream request that is already in
+    flight rather than sending another one."""
+    key = (text, source, target, client)
+    return upstream_flights.do(
+        key, __hedged_translate__,
+        (text, source, target, client, user_agent, deadline),
+        timeout=remaining_time(deadline))
+
+
+def __hedged_translate__(text, source, target, client='x',
+                         user_agent=DEFAULT_USER_AGENT, deadline=None):
+    """Same as :func:`__translate__`, but a slow upstream request is hedged
+    with another one if hedging is enabled."""
+    if upstream_hedger is None:
+        return __translate__(text, source, target, client, user_agent,
+                             deadline)
+
+    def call():
+        return __translate__(text, source, target, client, user_agent,
+                             deadline)
+
+    return upstream_hedger.call(call, call, timeout=remaining_time(deadline))
+
+
+def __intermediate_translate__(text, source, client='x',
+                               user_agent=DEFAULT_USER_AGENT, use_cache=True,
+                               deadline=None):
+    """Translates a text into the intermediate language (i.e., the first
+    leg of mode 2)."""
+    cache_key = (text, source, 'ja', client)
+    if use_cache:
+        cached = intermediate_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    result = __coalesced_translate__(text, source, 'ja', client, user_agent,
+                                     deadline)
+
+    if use_cache:
+        intermediate_cache.set(cache_key, result)
+
+    return result
+
+
+def translate(text, mode, source, target, client='x', user_agent=None,
+              use_cache=True, deadline=None):
+    started_at = time.time()
 
     if len(text) == 0:
         raise HTTPException('Text cannot be empty.', 400)
@@ -435,50 +906,404 @@ def translate(text, mode, source, target, client='x'):
     if target not in VALID_LANGUAGES.keys():
         raise HTTPException('Invalid target language.', 400)
 
-    user_agent = request.headers.get('User-Agent', 'Unknown')
+    metrics.observe('translator_stage_seconds', time.time() - started_at,
+                    (('stage', 'validate'),))
+
+    cache_key = (text, mode, source, target, client)
+    if use_cache:
+        cached = translation_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+
+    if user_agent is None:
+        user_agent = request.headers.get('User-Agent', 'Unknown')
 
     translated_raw = None
     translated_text = None
     intermediate_raw = None
     intermediate_text = None
 
-    # NOTE: The following may be time consuming operations
-    # FIXME: Refactor this code. Looks crappy.
-    if mode == '1':
-        if client == 't':
-            translated_raw = __translate__(text, source, target, client,
-                                           user_agent)
-            translated_text = ' '.join(map(lambda x: x[0], translated_raw[0]))
-        else:
-            translated_text = __translate__(text, source, target, client,
-                                            user_agent)
-
-    elif mode == '2':
-        if client == 't':
-            intermediate_raw = __translate__(text, source, 'ja', client,
-                                             user_agent)
-            intermediate_text = ' '.join(map(lambda x: x[0],
-                                             intermediate_raw[0]))
-            translated_raw = __translate__(intermediate_text, 'ja', target,
-                                           client, user_agent)
-            translated_text = ' '.join(map(lambda x: x[0], translated_raw[0]))
+    try:
+        # NOTE: The following may be time consuming operations
+        # FIXME: Refactor this code. Looks crappy.
+        if mode == '1':
+            if client == 't':
+                translated_raw = __coalesced_translate__(
+                    text, source, target, client, user_agent, deadline)
+                translated_text = ' '.join(map(lambda x: x[0],
+                                               translated_raw[0]))
+            else:
+                translated_text = __coalesced_translate__(
+                    text, source, target, client, user_agent, deadline)
+
+        elif mode == '2':
+            if client == 't':
+                intermediate_raw = __intermediate_translate__(
+                    text, source, client, user_agent, use_cache, deadline)
+                intermediate_text = ' '.join(map(lambda x: x[0],
+                                                 intermediate_raw[0]))
+                translated_raw = __coalesced_translate__(
+                    intermediate_text, 'ja', target, client, user_agent,
+                    deadline)
+                translated_text = ' '.join(map(lambda x: x[0],
+                                               translated_raw[0]))
+
+            else:
+                intermediate_text = __intermediate_translate__(
+                    text, source, client, user_agent, use_cache, deadline)
+                translated_text = __coalesced_translate__(
+                    intermediate_text, 'ja', target, client, user_agent,
+                    deadline)
 
         else:
-            intermediate_text = __translate__(text, source, 'ja', client,
-                                              user_agent)
-            translated_text = __translate__(intermediate_text, 'ja', target,
-                                            client, user_agent)
+            return HTTPException('Invalid translation mode.', 400)
+    except CircuitOpenError:
+        # An expired result is better than none while the upstream is
+        # unavailable
+        cached = translation_cache.get(cache_key, stale=True) \
+            if use_cache else None
+        if cached is None:
+            raise
+        return dict(cached)
+
+    result = dict(
+        id=None,
+        request_id=None,
+        intermediate_text=intermediate_text,
+        intermediate_raw=intermediate_raw,
+        translated_text=translated_text,
+        translated_raw=translated_raw,
+    )
+
+    if use_cache:
+        translation_cache.set(cache_key, result)
+
+    return result
+
+
+@api_module.route('/v1.2/translate/batch', methods=['POST'])
+def translate_batch():
+    """
+    :param sl: source language
+    :type sl: string
+    :param tl: target language
+    :type tl: string
+    :param m: mode ( 1 for normal, 2 for better )
+    :type m: int
+    :param t: texts to be translated (repeated)
+    :type t: string
+
+    Translates multiple texts sharing the same source and target languages.
+    A JSON body such as ``{"sl": "en", "tl": "ko", "m": "1", "t": [...]}`` is
+    accepted as well. Identical texts are translated only once.
+
+    Returns ``{"translations": [...]}`` in the order of the given texts. An
+    item that cannot be translated carries ``error`` and ``status_code``
+    instead of failing the whole batch.
+    """
+    body = request.get_json(silent=True)
+    if body is not None:
+        if not isinstance(body, dict) or \
+                not isinstance(body.get('t', []), list):
+            return 'Texts must be a list in a JSON object.', 400
+        # JSON strings are always unicode; other items fail one by one
+        texts = [t.strip() if isinstance(t, type(u'')) else None
+                 for t in body.get('t', [])]
+        mode, source, target = \
+            [str(body.get(k, '')).strip() for k in ('m', 'sl', 'tl')]
+    else:
+        texts = [t.strip() for t in request.form.getlist('t')]
+        mode, source, target = \
+            [request.form[k].strip() for k in ('m', 'sl', 'tl')]
+
+    if not texts:
+        return 'Texts cannot be empty.', 400
+    if len(texts) > MAX_BATCH_SIZE:
+        return 'Too many texts.', 413
+    if mode not in ('1', '2'):
+        return 'Invalid translation mode.', 400
+    if source not in VALID_LANGUAGES.keys():
+        return 'Invalid source language.', 400
+    if target not in VALID_LANGUAGES.keys():
+        return 'Invalid target language.', 400
 
+    user_agent = request.headers.get('User-Agent', 'Unknown')
+    use_cache = is_cache_enabled()
+    deadline = get_deadline()
+
+    def translate_one(text):
+        if text is None:
+            return {'error': 'Text must be a string.', 'status_code': 400}
+        if len(text) == 0:
+            return {'error': 'Text cannot be empty.', 'status_code': 400}
+        if len(text) > MAX_TEXT_LENGTH:
+            return {'error': 'Text too long.', 'status_code': 413}
+        try:
+            return translate(text, mode, source, target,
+                             user_agent=user_agent, use_cache=use_cache,
+                             deadline=deadline)
+        except HTTPException as e:
+            return {'error': e.message, 'status_code': e.status_code}
+        except Exception as e:
+            logger.exception(e)
+            return {'error': str(e), 'status_code': 500}
+
+    # Preserves the order of first appearances
+    unique_texts = list(OrderedDict.fromkeys(texts))
+    max_concurrency = get_config('batch', 'max_concurrency', 8, int)
+    results = dict(zip(unique_texts, parallel_map(
+        translate_one, unique_texts, max_concurrency)))
+
+    return jsonify({'translations': [results[t] for t in texts]})
+
+
+@api_module.route('/v1.2/translate/multi', methods=['POST'])
+def translate_multi_targets():
+    """
+    :param sl: source language
+    :type sl: string
+    :param tl: target languages (repeated or comma-separated)
+    :type tl: string
+    :param m: mode ( 1 for normal, 2 for better )
+    :type m: int
+    :param t: text to be translated
+    :type t: string
+
+    Translates a text into multiple target languages at once. Returns
+    ``{"translations": {"<target>": {...}, ...}}``. A target that cannot be
+    translated carries ``error`` and ``status_code`` instead.
+    """
+    keys = ('t', 'm', 'sl')
+    text, mode, source = map(lambda k: request.form[k].strip(), keys)
+    targets = [t.strip() for tl in request.form.getlist('tl')
+               for t in tl.split(',')]
+
+    try:
+        payload = translate_multi(text, mode, source, targets,
+                                  use_cache=is_cache_enabled(),
+                                  deadline=get_deadline())
+        return jsonify({'translations': payload})
+
+    except HTTPException as e:
+        return e.message, e.status_code
+
+    except Exception as e:
+        logger.exception(e)
+        return str(e), 500
+
+
+def translate_multi(text, mode, source, targets, client='x', user_agent=None,
+                    use_cache=True, deadline=None):
+    """Translates a text into each of ``targets``. In mode 2, the leg to the
+    intermediate language runs only once and the legs to the targets run
+    concurrently.
+
+    :return: A dictionary of target languages and their translation results
+    """
+    targets = list(OrderedDict.fromkeys(filter(None, targets)))
+
+    if len(text) == 0:
+        raise HTTPException('Text cannot be empty.', 400)
+    if len(text) > MAX_TEXT_LENGTH:
+        raise HTTPException('Text too long.', 413)
+    if mode not in ('1', '2'):
+        raise HTTPException('Invalid translation mode.', 400)
+    if source not in VALID_LANGUAGES.keys():
+        raise HTTPException('Invalid source language.', 400)
+    if not targets:
+        raise HTTPException('Target languages cannot be empty.', 400)
+    for target in targets:
+        if target not in VALID_LANGUAGES.keys():
+            raise HTTPException('Invalid target language.', 400)
+
+    if user_agent is None:
+        user_agent = request.headers.get('User-Agent', 'Unknown')
+
+    if use_cache and mode == '2' and any(t != source for t in targets):
+        # Warms up the intermediate cache so that the legs below share it.
+        # Without the cache, the legs run concurrently and share the
+        # intermediate request through the single-flight table instead.
+        __intermediate_translate__(text, source, client, user_agent,
+                                   use_cache, deadline)
+
+    def translate_target(target):
+        try:
+            return translate(text, mode, source, target, client, user_agent,
+                             use_cache, deadline)
+        except HTTPException as e:
+            return {'error': e.message, 'status_code': e.status_code}
+        except Exception as e:
+            logger.exception(e)
+            return {'error': str(e), 'status_code': 500}
+
+    max_concurrency = get_config('batch', 'max_concurrency', 8, int)
+    results = parallel_map(translate_target, targets, max_concurrency)
+
+    return dict(zip(targets, results))
+
+
+@api_module.route('/v1.2/translate/longtext', methods=['POST'])
+def translate_longtext():
+    """
+    :param sl: source language
+    :type sl: string
+    :param tl: target language
+    :type tl: string
+    :param m: mode ( 1 for normal, 2 for better )
+    :type m: int
+    :param t: text to be translated
+    :type t: string
+
+    Translates a long text by splitting it at sentence and paragraph
+    boundaries and translating the chunks in parallel. The original
+    whitespace and line breaks between the chunks are preserved.
+    """
+    keys = ('t', 'm', 'sl', 'tl')
+    text, mode, source, target = map(lambda k: request.form[k].strip(), keys)
+
+    try:
+        payload = translate_long(text, mode, source, target,
+                                 use_cache=is_cache_enabled(),
+                                 deadline=get_deadline())
+        return jsonify(payload)
+
+    except HTTPException as e:
+        return e.message, e.status_code
+
+    except Exception as e:
+        logger.exception(e)
+        return str(e), 500
+
+
+@api_module.route('/v1.2/translate/stream', methods=['POST'])
+def translate_stream():
+    """
+    :param sl: source language
+    :type sl: string
+    :param tl: target language
+    :type tl: string
+    :param m: mode ( 1 for normal, 2 for better )
+    :type m: int
+    :param t: text to be translated
+    :type t: string
+    :param format: ``ndjson`` (default) or ``sse``
+    :type format: string
+
+    Translates a text sentence by sentence, and streams each result as soon
+    as it is ready. The results may arrive out of order; each one carries
+    ``index``, ``orig``, ``trans`` and ``sep`` (the whitespace that follows
+    the sentence in the original text) so that clients can reassemble the
+    whole translation. In mode 2, ``intermediate`` is included as well.
+    A sentence that fails carries ``error`` and ``status_code`` instead.
+
+    With ``format=sse`` (or ``Accept: text/event-stream``), the results are
+    sent as Server-Sent Events followed by a ``done`` event.
+    """
+    keys = ('t', 'm', 'sl', 'tl')
+    text, mode, source, target = map(lambda k: request.form[k].strip(), keys)
+
+    if len(text) == 0:
+        return 'Text cannot be empty.', 400
+    if len(text) > MAX_LONG_TEXT_LENGTH:
+        return 'Text too long.', 413
+    if mode not in ('1', '2'):
+        return 'Invalid translation mode.', 400
+    if source not in VALID_LANGUAGES.keys():
+        return 'Invalid source language.', 400
+    if target not in VALID_LANGUAGES.keys():
+        return 'Invalid target language.', 400
+
+    use_sse = request.form.get('format') == 'sse' or \
+        request.accept_mimetypes.best == 'text/event-stream'
+    user_agent = request.headers.get('User-Agent', 'Unknown')
+    use_cache = is_cache_enabled()
+    deadline = get_deadline()
+    prefix, sentences = split_sentences(text)
+
+    def translate_sentence(sentence):
+        try:
+            return translate(sentence, mode, source, target,
+                             user_agent=user_agent, use_cache=use_cache,
+                             deadline=deadline)
+        except HTTPException as e:
+            return {'error': e.message, 'status_code': e.status_code}
+        except Exception as e:
+            logger.exception(e)
+            return {'error': str(e), 'status_code': 500}
+
+    def generate():
+        max_concurrency = get_config('longtext', 'max_concurrency', 4, int)
+        for index, result in unordered_map(
+                translate_sentence, [s for s, sep in sentences],
+                max_concurrency):
+            sentence, separator = sentences[index]
+            item = {'index': index, 'orig': sentence, 'sep': separator}
+            if 'error' in result:
+                item.update(result)
+            else:
+                item['trans'] = result['translated_text']
+                if mode == '2':
+                    item['intermediate'] = result['intermediate_text']
+
+            line = json.dumps(item)
+            if use_sse:
+                yield 'data: {}\n\n'.format(line)
+            else:
+                yield line + '\n'
+
+        if use_sse:
+            yield 'event: done\ndata: {}\n\n'
+
+    mimetype = 'text/event-stream' if use_sse else 'application/x-ndjson'
+    headers = {
+        'Cache-Control': 'no-cache',
+        # Keeps reverse proxies (e.g., nginx) from buffering the stream
+        'X-Accel-Buffering': 'no',
+    }
+    return Response(generate(), mimetype=mimetype, headers=headers)
+
+
+def translate_long(text, mode, source, target, client='x', user_agent=None,
+                   use_cache=True, deadline=None):
+    """Same as :func:`translate`, but for texts up to
+    ``MAX_LONG_TEXT_LENGTH`` characters."""
+
+    if len(text) == 0:
+        raise HTTPException('Text cannot be empty.', 400)
+
+    if len(text) > MAX_LONG_TEXT_LENGTH:
+        raise HTTPException('Text too long.', 413)
+
+    if mode not in ('1', '2'):
+        raise HTTPException('Invalid translation mode.', 400)
+
+    if user_agent is None:
+        user_agent = request.headers.get('User-Agent', 'Unknown')
+
+    chunk_size = get_config('longtext', 'chunk_size', 1000, int)
+    prefix, chunks = split_text(text, chunk_size)
+    chunk_texts = [chunk for chunk, separator in chunks]
+    separators = [separator for chunk, separator in chunks]
+
+    def translate_chunk(chunk):
+        return translate(chunk, mode, source, target, client, user_agent,
+                         use_cache, deadline)
+
+    max_concurrency = get_config('longtext', 'max_concurrency', 4, int)
+    results = parallel_map(translate_chunk, chunk_texts, max_concurrency)
+
+    if mode == '2' and source != target:
+        intermediate_text = join_text(
+            prefix, [r['intermediate_text'] for r in results], separators)
     else:
-        return HTTPException('Invalid translation mode.', 400)
+        intermediate_text = None
 
     return dict(
         id=None,
         request_id=None,
         intermediate_text=intermediate_text,
-        intermediate_raw=intermediate_raw,
-        translated_text=translated_text,
-        translated_raw=translated_raw,
+        translated_text=join_text(
+            prefix, [r['translated_text'] for r in results], separators),
     )
 
 
@@ -489,15 +1314,61 @@ def translate_v1_3():
     text, source, target = \
         [request_params[k] for k in ('text', 'source', 'target')]
     params = __params__(text, source, target)
-    resp = lambda_get(params['url'], params=params['payload'],
-                      headers=params['headers'])
-    resp_content = json.loads(resp['Payload'].read().decode('utf-8'))
+    try:
+        resp_content = lambda_get(params['url'], params=params['payload'],
+                                  headers=params['headers'],
+                                  deadline=get_deadline())
+    except HTTPException as e:
+        return e.message, e.status_code
     resp_text = resp_content['text']
     resp_status_code = resp_content['status_code']
 
     return resp_text, resp_status_code
 
 
+@api_module.route('/api/v1.3/translate/batch', methods=['post'])
+def translate_v1_3_batch():
+    """Translates multiple texts (repeated ``text`` parameters) sharing the
+    same ``source`` and ``target`` via AWS Lambda, using as few invocations
+    as possible. Returns ``{"responses": [...]}`` in the order of the given
+    texts, each of which has ``text`` and ``status_code`` of the upstream
+    response."""
+    texts = request.form.getlist('text')
+    source, target = request.form['source'], request.form['target']
+
+    if not texts:
+        return 'Texts cannot be empty.', 400
+    if len(texts) > MAX_BATCH_SIZE:
+        return 'Too many texts.', 413
+
+    reqs = []
+    for text in texts:
+        params = __params__(text, source, target)
+        reqs.append({'url': params['url'], 'params': params['payload'],
+                     'headers': params['headers']})
+
+    try:
+        responses = lambda_get_batch(reqs, deadline=get_deadline())
+    except HTTPException as e:
+        return e.message, e.status_code
+
+    return jsonify({'responses': responses})
+
+
+@api_module.route('/api/v1.3/proxy-stats')
+def proxy_stats():
+    """Returns the latency and error statistics of the web proxies."""
+    return jsonify({'proxies': proxy_selector.stats()})
+
+
+@api_module.route('/metrics')
+def metrics_():
+    """Exposes the metrics of all worker processes in the Prometheus text
+    format."""
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
 @api_module.route('/api/v1.3/exception')
 def exception():
     raise Exception(request.args.get('message', 'Anything you can imagine'))
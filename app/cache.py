@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""Caches for translation results."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from app import get_config, logger
+
+
+class LRUCache(object):
+    """A thread-safe, in-memory cache that evicts the least recently used
+    entry once ``maxsize`` is reached. Entries older than ``ttl`` seconds are
+    treated as missing, unless ``stale=True`` is given to :meth:`get`."""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None, stale=False):
+        with self._lock:
+            try:
+                value, expires_at = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            # Expired entries are kept around until they are evicted, in
+            # case a stale value is asked for
+            if expires_at < time.time() and not stale:
+                self.misses += 1
+                return default
+
+            # Move the entry to the most recently used position
+            del self._entries[key]
+            self._entries[key] = (value, expires_at)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class SQLiteCache(object):
+    """A translation cache stored in an on-disk SQLite database so that all
+    worker processes on a node share their results, and the results survive
+    worker restarts.
+
+    The database runs in WAL mode, hence readers never wait for writers, and
+    reads go through a memory-mapped view of the file. Values are stored as
+    zlib-compressed JSON and keys as SHA-1 digests. Entries are evicted in
+    insertion order (FIFO) once ``maxsize`` is exceeded; this keeps reads
+    free of bookkeeping writes. Expired entries are purged along the way,
+    after a grace period of another ``ttl`` during which they can still be
+    read with ``stale=True``.
+
+    The size reported by :meth:`stats` is approximate: counting the entries
+    takes a full scan, so it is only done on eviction passes, and writes of
+    this process are added up in between (those of other processes are
+    not).
+    """
+
+    #: Number of writes between two eviction passes
+    trim_interval = 256
+
+    def __init__(self, path, maxsize=100000, ttl=86400,
+                 mmap_size=64 * 1024 * 1024):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.mmap_size = mmap_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        self._size = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS translations ('
+                'key BLOB PRIMARY KEY, value BLOB NOT NULL, '
+                'created_at REAL NOT NULL, expires_at REAL NOT NULL)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS translations_created_at '
+                'ON translations (created_at)')
+        self._size = len(self)
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM translations').fetchone()[0]
+
+    def _connection(self):
+        """Returns a connection owned by the current thread. A connection
+        must not be carried over to a forked child process."""
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA mmap_size={:d}'.format(self.mmap_size))
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    @staticmethod
+    def encode_key(key):
+        raw = json.dumps(key, ensure_ascii=False, separators=(',', ':'))
+        return sqlite3.Binary(hashlib.sha1(raw.encode('utf-8')).digest())
+
+    @staticmethod
+    def encode_value(value):
+        raw = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        return sqlite3.Binary(zlib.compress(raw.encode('utf-8')))
+
+    @staticmethod
+    def decode_value(value):
+        return json.loads(zlib.decompress(value).decode('utf-8'))
+
+    def get(self, key, default=None, stale=False):
+        try:
+            row = self._connection().execute(
+                'SELECT value FROM translations '
+                'WHERE key = ? AND expires_at >= ?',
+                (self.encode_key(key),
+                 0 if stale else time.time())).fetchone()
+        except sqlite3.Error as e:
+            logger.warning('Translation cache read failed: {}'.format(e))
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return default
+        return self.decode_value(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO translations '
+                    '(key, value, created_at, expires_at) VALUES (?, ?, ?, ?)',
+                    (self.encode_key(key), self.encode_value(value), now,
+                     now + self.ttl))
+        except sqlite3.Error as e:
+            logger.warning('Translation cache write failed: {}'.format(e))
+            return
+
+        with self._lock:
+            self._writes += 1
+            self._size += 1
+            due = self._writes % self.trim_interval == 0
+        if due:
+            self.trim()
+
+    def trim(self):
+        """Purges entries that expired more than ``ttl`` seconds ago and
+        evicts the oldest entries beyond ``maxsize``."""
+        try:
+            with self._connection() as conn:
+                expired = conn.execute(
+                    'DELETE FROM translations WHERE expires_at < ?',
+                    (time.time() - self.ttl,)).rowcount
+                overflow = conn.execute(
+                    'DELETE FROM translations WHERE key IN ('
+                    'SELECT key FROM translations ORDER BY created_at '
+                    'LIMIT max((SELECT COUNT(*) FROM translations) - ?, 0))',
+                    (self.maxsize,)).rowcount
+                size = conn.execute(
+                    'SELECT COUNT(*) FROM translations').fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning('Translation cache trim failed: {}'.format(e))
+            return
+
+        with self._lock:
+            self.evictions += expired + overflow
+            self._size = size
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM translations')
+        with self._lock:
+            self._size = 0
+
+    def stats(self):
+        return {
+            'size': self._size,
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def create_translation_cache(name='translation'):
+    """Creates a translation cache as configured in the ``cache`` section.
+    ``cache.backend`` is either ``memory`` (per process, default) or
+    ``sqlite`` (shared by all processes on a node).
+
+    :param name: ``translation``, or ``intermediate`` for the cache of the
+                 first legs of mode 2 translations, which reads
+                 ``cache.intermediate_path`` and ``cache.intermediate_maxsize``
+                 instead so that the two caches never share a database
+    """
+    backend = get_config('cache', 'backend', 'memory')
+    maxsize = get_config('cache', 'maxsize', 4096, int)
+    ttl = get_config('cache', 'ttl', 3600, int)
+    path = get_config('cache', 'path', '/tmp/translator-cache.sqlite')
+
+    if name == 'intermediate':
+        maxsize = get_config('cache', 'intermediate_maxsize', maxsize, int)
+        root, ext = os.path.splitext(path)
+        path = get_config('cache', 'intermediate_path') or \
+            '{}-intermediate{}'.format(root, ext)
+    elif name != 'translation':
+        raise ValueError('Unknown cache: {}'.format(name))
+
+    if backend == 'memory':
+        return LRUCache(maxsize=maxsize, ttl=ttl)
+    elif backend == 'sqlite':
+        return SQLiteCache(path, maxsize=maxsize, ttl=ttl)
+    else:
+        raise ValueError('Unknown cache backend: {}'.format(backend))
+
+
+translation_cache = create_translation_cache()
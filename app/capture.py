@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Captures the traffic of the translation endpoints for bin/replay.py.
+
+If the ``capture`` section enables it, a sample (``capture.sample_rate``) of
+the requests whose path matches ``capture.paths`` is appended to a JSON
+lines file per process, ``traffic-<pid>.jsonl`` in ``capture.directory``.
+Each line holds the time the request arrived, its method, path, query and
+form parameters, its JSON body if any, and the status and duration of its
+response (500 if the request failed with an exception). Unless
+``capture.redact`` is disabled, letters and digits of texts to translate
+are replaced with ``x`` so that no user content is kept, while the length
+and the shape (words, lines and punctuation) of the texts are.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from flask import g, request
+
+from app import get_config, logger, to_bool
+
+
+#: Parameters that hold texts to translate
+TEXT_PARAMS = ('t', 'text', 'q')
+
+WORD_CHARACTER = re.compile(r'\w', re.UNICODE)
+
+
+def redact(text):
+    """Replaces letters and digits with ``x``."""
+    return WORD_CHARACTER.sub('x', text)
+
+
+def to_params(multidict, redacted):
+    """Converts request parameters into a dictionary of lists of values,
+    which is what bin/replay.py sends back."""
+    params = {}
+    for key, values in multidict.lists():
+        if redacted and key in TEXT_PARAMS:
+            values = [redact(value) for value in values]
+        params[key] = values
+    return params
+
+
+def to_json(body, redacted):
+    """Returns a JSON request body (e.g., of a batch translation) with its
+    texts redacted."""
+    if not redacted or not isinstance(body, dict):
+        return body
+
+    body = dict(body)
+    for key in TEXT_PARAMS:
+        value = body.get(key)
+        if isinstance(value, type(u'')):
+            body[key] = redact(value)
+        elif isinstance(value, list):
+            body[key] = [redact(x) if isinstance(x, type(u'')) else x
+                         for x in value]
+    return body
+
+
+class TrafficRecorder(object):
+    """Records sampled requests of the app it is initialized with. Each app
+    has a recorder of its own (``app.extensions['recorder']``), as its
+    settings are read when the app is created."""
+
+    def __init__(self, app=None):
+        self.recorded = 0
+        self._file = None
+        self._file_pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = get_config('capture', 'enabled', False, to_bool)
+        self.sample_rate = get_config('capture', 'sample_rate', 1.0, float)
+        self.redact = get_config('capture', 'redact', True, to_bool)
+        self.directory = get_config('capture', 'directory',
+                                    '/tmp/translator-traffic')
+        self.paths = re.compile(get_config(
+            'capture', 'paths', r'^(/api)?/v1\.\d+/translate'))
+
+        if self.enabled:
+            app.before_request(self.start)
+            app.after_request(self.keep_status)
+            # Teardown callbacks run even if the request failed
+            app.teardown_request(self.stop)
+
+    def start(self):
+        if self.paths.match(request.path) and \
+                random.random() < self.sample_rate:
+            g.capture_started_at = time.time()
+
+    def keep_status(self, response):
+        if 'capture_started_at' in g:
+            g.capture_status = response.status_code
+        return response
+
+    def stop(self, exception=None):
+        started_at = g.pop('capture_started_at', None)
+        if started_at is None:
+            return
+        status = g.pop('capture_status', None)
+        if exception is not None or status is None:
+            status = 500
+
+        record = {
+            'timestamp': started_at,
+            'method': request.method,
+            'path': request.path,
+            'args': to_params(request.args, self.redact),
+            'form': to_params(request.form, self.redact),
+            'json': to_json(request.get_json(silent=True), self.redact),
+            'status': status,
+            'duration': time.time() - started_at,
+        }
+        try:
+            self.write(json.dumps(record, sort_keys=True) + '\n')
+        except (IOError, OSError) as e:
+            logger.warning('Failed to capture a request: {}'.format(e))
+
+    def get_file(self):
+        """Returns the file of the current process, opening it if this is a
+        new (e.g., forked) process."""
+        if self._file is None or self._file_pid != os.getpid():
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            path = os.path.join(self.directory,
+                                'traffic-{}.jsonl'.format(os.getpid()))
+            self._file = open(path, 'a')
+            self._file_pid = os.getpid()
+        return self._file
+
+    def write(self, line):
+        with self._lock:
+            f = self.get_file()
+            f.write(line)
+            f.flush()
+            self.recorded += 1
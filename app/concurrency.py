@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Helpers to run upstream requests concurrently."""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import as_completed, Future, FIRST_COMPLETED, \
+    ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+
+from app import get_config, to_bool
+from app.utils import HTTPException
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the process-wide executor for background calls (e.g., hedged
+    requests) whose callers must not wait for them to finish. Its size is
+    set by ``hedge.max_workers``."""
+    global _executor, _executor_pid
+
+    pid = os.getpid()
+    if _executor is not None and _executor_pid == pid:
+        return _executor
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            max_workers = get_config('hedge', 'max_workers', 64, int)
+            _executor = ThreadPoolExecutor(max_workers=max_workers)
+            _executor_pid = pid
+
+    return _executor
+
+
+def parallel_map(func, items, max_workers):
+    """Applies ``func`` to every item using at most ``max_workers`` threads
+    and returns the results in the order of ``items``.
+
+    The calling thread's Flask request context is not available to ``func``;
+    anything it needs from the request must be passed in explicitly.
+    """
+    items = list(items)
+    if not items:
+        return []
+    if len(items) == 1 or max_workers <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) \
+            as executor:
+        return list(executor.map(func, items))
+
+
+def unordered_map(func, items, max_workers):
+    """Applies ``func`` to every item using at most ``max_workers`` threads
+    and yields ``(index, result)`` tuples as soon as each one completes.
+    Calls that have not started yet are cancelled if the consumer stops
+    iterating (e.g., a client disconnects from a streaming response).
+
+    If ``func`` raises an exception, it is re-raised from the generator.
+    """
+    items = list(items)
+    if not items:
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers,
+                                                         len(items))))
+    futures = {}
+    try:
+        for index, item in enumerate(items):
+            futures[executor.submit(func, item)] = index
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls sharing the same key: the first caller runs
+    the function while the others wait for it and share its result (or its
+    exception)."""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, args=(), timeout=None):
+        """Calls ``func(*args)`` unless a call for ``key`` is already in
+        flight, in which case its result is awaited for at most ``timeout``
+        seconds."""
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = self._in_flight[key] = Future()
+                leader = True
+
+        if not leader:
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                raise HTTPException('Request timed out.', 504)
+
+        try:
+            result = func(*args)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # e.g., GreenletExit; the followers must not wait until they time
+            # out, nor be interrupted themselves
+            future.set_exception(
+                HTTPException('Request was interrupted.', 503))
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._in_flight),
+        }
+
+
+class LatencyTracker(object):
+    """Keeps the latencies of the most recent ``size`` calls."""
+
+    def __init__(self, size=256):
+        self._samples = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, latency):
+        self._samples.append(latency)
+
+    def percentile(self, p):
+        """Returns the ``p``-th percentile (0-100) of the recorded latencies,
+        or ``None`` if nothing has been recorded yet."""
+        samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * p / 100.0))
+        return samples[index]
+
+
+class Hedger(object):
+    """Sends a backup request when the primary one is slower than the
+    ``percentile``-th percentile of recent latencies, and takes whichever
+    response comes first. The other one is cancelled if it has not started
+    yet, or discarded otherwise.
+
+    To keep the extra load bounded, each call earns ``max_rate`` tokens and a
+    backup request spends one; no backup request is sent without a token.
+    Hence, at most ``max_rate`` of the calls are hedged in the long run.
+    """
+
+    #: Number of samples required before the observed percentile is used
+    min_samples = 20
+
+    def __init__(self, percentile=95, max_rate=0.05, min_delay=0.05,
+                 default_delay=1.0, max_tokens=10):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.max_tokens = max_tokens
+        self.latencies = LatencyTracker()
+        self.calls = 0
+        self.hedged = 0
+        self.backup_wins = 0
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Returns how long to wait for the primary request, in seconds."""
+        if len(self.latencies) < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, self.latencies.percentile(self.percentile))
+
+    def _take_token(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.hedged += 1
+                return True
+            return False
+
+    def call(self, primary, backup, timeout=None):
+        """Calls ``primary`` and, if necessary, ``backup`` (both without
+        arguments) and returns the first successful result. If both fail,
+        the last exception is raised. If neither returns within ``timeout``
+        seconds, an :class:`HTTPException` (504) is raised."""
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self.max_tokens, self._tokens + self.max_rate)
+
+        expires_at = None if timeout is None else time.time() + timeout
+
+        def remaining():
+            if expires_at is None:
+                return None
+            return max(0, expires_at - time.time())
+
+        # Time spent waiting for a thread of the executor is not upstream
+        # latency; counting it would send more backups as the executor
+        # falls behind, which would make it fall further behind
+        running = threading.Event()
+
+        def run_primary():
+            running.started_at = time.time()
+            running.set()
+            return primary()
+
+        executor = get_executor()
+        first = executor.submit(run_primary)
+        running.wait(remaining())
+        if not running.is_set():
+            first.cancel()
+            raise HTTPException('Request timed out.', 504)
+        started_at = running.started_at
+
+        delay = self.delay()
+        if timeout is not None and remaining() < delay:
+            delay = remaining()
+        try:
+            result = first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        else:
+            self.latencies.record(time.time() - started_at)
+            return result
+
+        # A backup request sent without any budget left could only time out
+        if remaining() == 0:
+            raise HTTPException('Request timed out.', 504)
+
+        if not self._take_token():
+            try:
+                result = first.result(timeout=remaining())
+            except FutureTimeoutError:
+                raise HTTPException('Request timed out.', 504)
+            self.latencies.record(time.time() - started_at)
+            return result
+
+        second = executor.submit(backup)
+        pending = set([first, second])
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=remaining(),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                raise HTTPException('Request timed out.', 504)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for other in pending:
+                    other.cancel()
+                if future is second:
+                    self.backup_wins += 1
+                self.latencies.record(time.time() - started_at)
+                return future.result()
+        raise error
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'hedged': self.hedged,
+            'backup_wins': self.backup_wins,
+            'delay': self.delay(),
+        }
+
+
+def create_hedger():
+    """Creates a :class:`Hedger` as configured in the ``hedge`` section, or
+    returns ``None`` if hedging is disabled."""
+    if not get_config('hedge', 'enabled', False, to_bool):
+        return None
+    return Hedger(percentile=get_config('hedge', 'percentile', 95, float),
+                  max_rate=get_config('hedge', 'max_rate', 0.05, float),
+                  min_delay=get_config('hedge', 'min_delay', 0.05, float))
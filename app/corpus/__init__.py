@@ -4,8 +4,6 @@ from datetime import datetime
 
 from flask import Blueprint, jsonify, request
 
-from app.corpus.models import Translation
-
 
 corpus_module = Blueprint('corpus', __name__, template_folder='templates')
 
@@ -13,6 +11,8 @@ corpus_module = Blueprint('corpus', __name__, template_folder='templates')
 @corpus_module.route('/raw', methods=['POST'])
 def corpus_raw():
     """Collects raw corpus data."""
+    # PynamoDB (and botocore) take long to import
+    from app.corpus.models import Translation
 
     raw, source_lang, target_lang = \
         map(lambda x: request.form[x], ('raw', 'sl', 'tl'))
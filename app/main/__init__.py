@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 from flask import Blueprint, request, render_template, url_for, redirect
-from flask.ext.babel import gettext as _
+from flask.ext.babel import gettext as _, get_locale
 from datetime import datetime
+from functools import wraps
 
-from app import __version__, get_locale
+from app import __version__, get_config, to_bool
+from app.cache import LRUCache
 from app.utils import language_options_html
 
 import json
@@ -11,8 +13,75 @@ import os
 
 main_module = Blueprint('main', __name__, template_folder='templates')
 
+#: Rendered pages and fragments, keyed by everything they depend on
+page_cache = LRUCache(maxsize=get_config('page_cache', 'maxsize', 256, int),
+                      ttl=get_config('page_cache', 'ttl', 86400, int))
+
+
+def invalidate_page_cache():
+    """Drops all rendered pages and fragments, e.g., once templates or
+    translations have changed. Entries are keyed by ``__version__`` as well,
+    so a deployment of a new version never serves stale pages."""
+    page_cache.clear()
+
+
+def user_agent_flags():
+    """Returns the user agent flags that pages are rendered with."""
+    user_agent = request.headers.get('User-Agent', '')
+    is_android = 'Android' in user_agent
+    is_iphone = 'iPhone' in user_agent
+    return dict(
+        is_android=is_android,
+        is_iphone=is_iphone,
+        is_mobile=is_android or is_iphone,
+        is_msie='MSIE' in user_agent,
+    )
+
+
+def cached_page(bypass_args=()):
+    """Caches the rendered output of a view that depends on nothing but the
+    URL root (scheme and host, as pages link to ``request.base_url``), the
+    path, the locale (as resolved by Babel) and the user agent
+    flags. Other query parameters (e.g., ``utm_source``) do not make pages
+    of their own, so they cannot push pages out of the cache. Responses that
+    are not rendered pages (e.g., redirects) are not cached.
+
+    :param bypass_args: Query parameters that the view reads; requests that
+                        carry any of them bypass the cache
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not get_config('page_cache', 'enabled', True, to_bool) or \
+                    any(arg in request.args for arg in bypass_args):
+                return view(*args, **kwargs)
+
+            key = ('page', __version__, request.url_root, request.path,
+                   str(get_locale()),
+                   tuple(sorted(user_agent_flags().items())))
+            page = page_cache.get(key)
+            if page is None:
+                page = view(*args, **kwargs)
+                if isinstance(page, type(u'')):
+                    page_cache.set(key, page)
+            return page
+        return wrapper
+    return decorator
+
+
+def cached_language_options_html():
+    """Returns :func:`language_options_html` for the current locale, which
+    is computed only once per locale."""
+    key = ('language_options', __version__, str(get_locale()))
+    html = page_cache.get(key)
+    if html is None:
+        html = language_options_html()
+        page_cache.set(key, html)
+    return html
+
 
 @main_module.route('/about')
+@cached_page()
 def about():
     return render_template('about.html')
 
@@ -60,6 +129,7 @@ def backupdb():
 #
 @main_module.route('/')
 @main_module.route('/tr/<translation_id>')
+@cached_page(bypass_args=('tr',))
 def index(translation_id=None):
     """The main page."""
 
@@ -70,20 +140,12 @@ def index(translation_id=None):
     # reserved for special purposes.
 
     # FIXME: The following values must exist in other pages as well
-    user_agent = request.headers.get('User-Agent', [])
-    is_android = 'Android' in user_agent
-    is_iphone = 'iPhone' in user_agent
-    is_msie = 'MSIE' in user_agent
-
     context = dict(
         version=__version__,
-        locale=get_locale(),
-        is_android=is_android,
-        is_iphone=is_iphone,
-        is_mobile=is_android or is_iphone,
-        is_msie=is_msie,
-        language_options=language_options_html(),
+        locale=str(get_locale()),
+        language_options=cached_language_options_html(),
         debug=os.environ.get('DEBUG', None),
+        **user_agent_flags()
     )
 
     tresponse = None
@@ -129,19 +191,21 @@ def set_locale():
 
 
 @main_module.route('/discuss')
+@cached_page()
 def discuss():
     context = dict(
         version=__version__,
-        locale=get_locale(),
+        locale=str(get_locale()),
     )
     return render_template('discuss.html', **context)
 
 
 @main_module.route('/credits')
+@cached_page()
 def credits():
     context = dict(
         version=__version__,
-        locale=get_locale(),
+        locale=str(get_locale()),
     )
     return render_template('credits.html', **context)
 
@@ -174,10 +238,11 @@ def test():
 
 
 @main_module.route('/disclaimers')
+@cached_page()
 def disclaimers():
     context = dict(
         version=__version__,
-        locale=get_locale(),
+        locale=str(get_locale()),
     )
     return render_template('disclaimers.html', **context)
 
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""Low-overhead counters and latency histograms, exposed in the Prometheus
+text format.
+
+Every thread records into a shard of its own, so nothing on the hot path
+waits for a lock; shards are only merged when metrics are collected, or
+into a single shard of retired threads when their threads exit. Worker
+processes of a prefork server each write a snapshot of their metrics to a
+file named after their pid in ``metrics.directory``, and the process that
+serves ``/metrics`` merges the snapshots of all of them. Snapshots of
+workers that are gone are removed along the way. Without a directory, only
+the metrics of the serving process are exposed.
+"""
+import errno
+import glob
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from app import get_config, logger, to_bool
+
+
+#: Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: Read once, as looking settings up is costly on the hot path
+enabled = get_config('metrics', 'enabled', True, to_bool)
+
+
+class Shard(object):
+    """Metrics recorded by a single thread."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.counters = {}
+        # Bucket counts (the last bucket being +Inf) followed by the sum and
+        # the count of observations
+        self.histograms = {}
+
+    def merge(self, other):
+        """Adds up the metrics of another shard into this one."""
+        # Copying a dictionary does not let other threads in, so it does not
+        # change while it is being copied
+        for key, value in dict(other.counters).items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, histogram in dict(other.histograms).items():
+            merged = self.histograms.setdefault(key, [0] * len(histogram))
+            for index, value in enumerate(list(histogram)):
+                merged[index] += value
+
+
+class ShardHolder(object):
+    """Holds the shard of a thread in its thread-local storage, which is
+    dropped when the thread exits."""
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+_local = threading.local()
+_shards = []
+_shards_pid = None
+# Shards of threads that have exited (e.g., the per-request pools of
+# parallel_map), merged into one
+_retired = None
+_holder_refs = set()
+_shards_lock = threading.RLock()
+_collectors = []
+_flusher_pid = None
+
+
+def get_shard():
+    """Returns the shard of the current thread. A shard inherited from the
+    parent of a forked process is left behind, so that metrics are not
+    counted twice."""
+    global _shards, _shards_pid, _retired
+
+    holder = getattr(_local, 'holder', None)
+    if holder is not None and holder.shard.pid == os.getpid():
+        return holder.shard
+
+    shard = Shard()
+    holder = _local.holder = ShardHolder(shard)
+    with _shards_lock:
+        if _shards_pid != shard.pid:
+            _shards = []
+            _shards_pid = shard.pid
+            _retired = Shard()
+            _holder_refs.clear()
+        _shards.append(shard)
+        _holder_refs.add(weakref.ref(
+            holder, lambda ref: retire_shard(ref, shard)))
+    start_flusher()
+    return shard
+
+
+def retire_shard(ref, shard):
+    """Folds the shard of an exited thread into the retired shard, so that
+    the list of shards does not grow with every thread ever started."""
+    with _shards_lock:
+        _holder_refs.discard(ref)
+        if shard.pid != _shards_pid or shard not in _shards:
+            return
+        _shards.remove(shard)
+        _retired.merge(shard)
+
+
+def increment(name, labels=(), value=1):
+    """Increments a counter.
+
+    :param labels: A tuple of ``(name, value)`` tuples
+    """
+    if not enabled:
+        return
+    counters = get_shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, value, labels=()):
+    """Records an observation (e.g., a latency in seconds) in a
+    histogram."""
+    if not enabled:
+        return
+    histograms = get_shard().histograms
+    key = (name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(BUCKETS) + 3)
+
+    for index, bound in enumerate(BUCKETS):
+        if value <= bound:
+            histogram[index] += 1
+            break
+    else:
+        histogram[len(BUCKETS)] += 1
+    histogram[-2] += value
+    histogram[-1] += 1
+
+
+@contextmanager
+def timed(name, labels=()):
+    """Records how long the block takes in a histogram, whether or not it
+    raises an exception."""
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - started_at, labels)
+
+
+def register_collector(func):
+    """Registers a function that returns a list of ``(name, labels, value)``
+    gauges (e.g., the size of a cache), to be called on collection."""
+    _collectors.append(func)
+    return func
+
+
+def snapshot():
+    """Merges the shards of the current process along with its gauges.
+
+    :return: A dictionary of ``counters``, ``histograms`` and ``gauges``,
+             each one being a list of ``[name, labels, value]``
+    """
+    merged = Shard()
+    # Holding the lock keeps shards from being retired (and counted twice)
+    # while they are merged
+    with _shards_lock:
+        if _shards_pid == os.getpid():
+            merged.merge(_retired)
+            for shard in _shards:
+                merged.merge(shard)
+    counters, histograms = merged.counters, merged.histograms
+
+    gauges = []
+    for collector in _collectors:
+        try:
+            gauges.extend(collector())
+        except Exception as e:
+            logger.warning('Metrics collector failed: {}'.format(e))
+
+    return {
+        'counters': [[name, labels, value]
+                     for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, value]
+                       for (name, labels), value in histograms.items()],
+        'gauges': [[name, labels, value] for name, labels, value in gauges],
+    }
+
+
+def get_directory():
+    return get_config('metrics', 'directory') or None
+
+
+def write_snapshot(directory):
+    """Writes the snapshot of the current process where :func:`collect`
+    finds it."""
+    path = os.path.join(directory, 'metrics-{}.json'.format(os.getpid()))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot(), f)
+    os.rename(tmp_path, path)
+
+
+def is_stale(path, pid, max_age):
+    """Indicates whether a snapshot was written by a process that is gone,
+    or has not been updated for ``max_age`` seconds (e.g., by a worker in
+    another container)."""
+    try:
+        os.kill(int(pid), 0)
+    except ValueError:
+        return True
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return True
+    try:
+        return os.path.getmtime(path) < time.time() - max_age
+    except OSError:
+        return True
+
+
+def start_flusher():
+    """Starts a thread that writes the snapshot of the current process every
+    ``metrics.flush_interval`` seconds, unless there is no directory to
+    write it to."""
+    global _flusher_pid
+
+    directory = get_directory()
+    if directory is None or _flusher_pid == os.getpid():
+        return
+    _flusher_pid = os.getpid()
+
+    interval = get_config('metrics', 'flush_interval', 5, float)
+
+    def flush():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(directory)
+            except (IOError, OSError) as e:
+                logger.warning('Failed to write metrics: {}'.format(e))
+
+    thread = threading.Thread(target=flush, name='metrics-flusher')
+    thread.daemon = True
+    thread.start()
+
+
+def collect():
+    """Returns the snapshots of all worker processes. The gauges of each
+    process are labeled with its pid; counters and histograms are summed
+    up."""
+    directory = get_directory()
+    if directory is None:
+        snapshots = [(os.getpid(), snapshot())]
+    else:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        write_snapshot(directory)
+        max_age = 3 * get_config('metrics', 'flush_interval', 5, float)
+        snapshots = []
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+            if is_stale(path, pid, max_age):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append((pid, json.load(f)))
+            except (IOError, OSError, ValueError) as e:
+                logger.warning('Failed to read {}: {}'.format(path, e))
+
+    counters = {}
+    histograms = {}
+    gauges = []
+    for pid, data in snapshots:
+        for name, labels, value in data['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in data['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [0] * len(value))
+            for index, x in enumerate(value):
+                merged[index] += x
+        for name, labels, value in data['gauges']:
+            gauges.append((name, tuple(map(tuple, labels)) +
+                           (('pid', str(pid)),), value))
+
+    return counters, histograms, gauges
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels) + '}'
+
+
+def render():
+    """Renders the metrics of all worker processes in the Prometheus text
+    format."""
+    counters, histograms, gauges = collect()
+    lines = []
+
+    for name in sorted(set(name for name, _ in counters)):
+        lines.append('# TYPE {} counter'.format(name))
+        for (key, labels), value in sorted(counters.items()):
+            if key == name:
+                lines.append('{}{} {}'.format(name, format_labels(labels),
+                                              value))
+
+    for name in sorted(set(name for name, _ in histograms)):
+        lines.append('# TYPE {} histogram'.format(name))
+        for (key, labels), value in sorted(histograms.items()):
+            if key != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), value[:-2]):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels + (('le', bound),)),
+                    cumulative))
+            lines.append('{}_sum{} {}'.format(name, format_labels(labels),
+                                              value[-2]))
+            lines.append('{}_count{} {}'.format(name, format_labels(labels),
+                                                value[-1]))
+
+    for name in sorted(set(name for name, _, _ in gauges)):
+        lines.append('# TYPE {} gauge'.format(name))
+        for key, labels, value in sorted(gauges, key=lambda x: x[:2]):
+            if key == name:
+                lines.append('{}{} {}'.format(name, format_labels(labels),
+                                              value))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Profiles sampled requests in production.
+
+A request is profiled if profiling is enabled in the ``profiling`` section
+and it is sampled (``profiling.sample_rate``), or if it carries an
+``X-Profile`` header matching ``profiling.token``. Either way, at most
+``profiling.max_per_minute`` requests are profiled per process. CPU profiles
+(cProfile) are written as ``.prof`` files along with a summary of the
+slowest functions, and memory profiles (tracemalloc) as a list of the top
+allocation sites, in ``profiling.directory``.
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from flask import g, request
+
+from app import get_config, logger, to_bool
+from app.upstream import TokenBucket
+
+
+#: Profiling modes a request may ask for with the ``X-Profile-Mode`` header
+MODES = ('cpu', 'memory', 'both')
+
+
+class RequestProfiler(object):
+    """Profiles sampled requests of the app it is initialized with. Each app
+    has a profiler of its own (``app.extensions['profiler']``), as its
+    settings are read when the app is created."""
+
+    def __init__(self, app=None):
+        self.profiled = 0
+        self._bucket = None
+        self._bucket_lock = threading.Lock()
+        # tracemalloc traces the whole process, so only one request at a time
+        # may be traced
+        self._memory_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = get_config('profiling', 'enabled', False, to_bool)
+        self.token = get_config('profiling', 'token') or None
+        self.sample_rate = get_config('profiling', 'sample_rate', 0.01, float)
+        self.mode = get_config('profiling', 'mode', 'cpu')
+        self.directory = get_config('profiling', 'directory',
+                                    '/tmp/translator-profiles')
+        self.top = get_config('profiling', 'top', 30, int)
+        max_per_minute = get_config('profiling', 'max_per_minute', 6, float)
+        self._bucket = TokenBucket(max_per_minute / 60.0, capacity=1)
+
+        app.before_request(self.start)
+        app.teardown_request(self.stop)
+
+    def select_mode(self):
+        """Returns the profiling mode for the current request, or ``None``
+        if it is not to be profiled."""
+        header = request.headers.get('X-Profile')
+        if header is not None and self.token is not None and \
+                hmac.compare_digest(header.encode('utf-8'),
+                                    self.token.encode('utf-8')):
+            mode = request.headers.get('X-Profile-Mode', self.mode)
+        elif self.enabled and random.random() < self.sample_rate:
+            mode = self.mode
+        else:
+            return None
+
+        if mode not in MODES:
+            return None
+        with self._bucket_lock:
+            if not self._bucket.take():
+                return None
+        return mode
+
+    def start(self):
+        if not self.enabled and self.token is None:
+            return
+
+        mode = self.select_mode()
+        if mode is None:
+            return
+
+        g.profile = {'started_at': time.time()}
+        if mode in ('memory', 'both'):
+            try:
+                import tracemalloc
+            except ImportError:
+                logger.warning('tracemalloc is not available')
+            else:
+                if self._memory_lock.acquire(False):
+                    tracemalloc.start()
+                    g.profile['tracemalloc'] = tracemalloc
+
+        if mode in ('cpu', 'both'):
+            profile = g.profile['cpu'] = cProfile.Profile()
+            profile.enable()
+
+    def stop(self, exception=None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+
+        cpu = profile.get('cpu')
+        if cpu is not None:
+            cpu.disable()
+
+        snapshot = None
+        tracemalloc = profile.get('tracemalloc')
+        if tracemalloc is not None:
+            try:
+                snapshot = tracemalloc.take_snapshot()
+            finally:
+                tracemalloc.stop()
+                self._memory_lock.release()
+
+        self.profiled += 1
+        try:
+            self.write(profile['started_at'], cpu, snapshot)
+        except (IOError, OSError) as e:
+            logger.warning('Failed to write profile: {}'.format(e))
+
+    def write(self, started_at, cpu, snapshot):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        name = '{}-{}-{}-{}'.format(
+            time.strftime('%Y%m%d%H%M%S', time.gmtime(started_at)),
+            int(started_at * 1000) % 1000,
+            re.sub(r'[^\w.-]', '_', request.endpoint or 'unknown'),
+            os.getpid())
+        path = os.path.join(self.directory, name)
+        header = '{} {} ({:.1f} ms)\n\n'.format(
+            request.method, request.full_path,
+            (time.time() - started_at) * 1000)
+
+        if cpu is not None:
+            cpu.dump_stats(path + '.prof')
+            buf = io.StringIO() if str is not bytes else io.BytesIO()
+            stats = pstats.Stats(cpu, stream=buf)
+            stats.sort_stats('cumulative').print_stats(self.top)
+            with open(path + '-cpu.txt', 'w') as f:
+                f.write(header)
+                f.write(buf.getvalue())
+
+        if snapshot is not None:
+            with open(path + '-memory.txt', 'w') as f:
+                f.write(header)
+                for stat in snapshot.statistics('lineno')[:self.top]:
+                    f.write('{}\n'.format(stat))
+
+        logger.info('Profiled {} into {}'.format(request.full_path, path))
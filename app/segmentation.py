@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Splits long texts into chunks that can be translated independently, and
+puts the translated chunks back together."""
+import re
+
+
+# Whitespace after a sentence terminator, any whitespace run containing a
+# newline, or the (possibly empty) gap after a CJK sentence terminator
+SENTENCE_BOUNDARY = re.compile(
+    u'(?<=[.!?])\\s+|\\s*\\n\\s*|(?<=[。！？])\\s*')
+
+WHITESPACE = re.compile(r'\s+', re.UNICODE)
+
+
+def split_sentences(text):
+    """Splits a text into sentences.
+
+    :return: A tuple of the leading whitespace and a list of
+             ``(sentence, separator)`` tuples, where ``separator`` is the
+             original whitespace that follows the sentence.
+    """
+    stripped = text.lstrip()
+    prefix = text[:len(text) - len(stripped)]
+
+    sentences = []
+    position = 0
+    for match in SENTENCE_BOUNDARY.finditer(stripped):
+        start, end = match.span()
+        if start == position:
+            # Nothing but whitespace in between; fold it into the previous
+            # separator
+            if sentences and end > start:
+                sentence, separator = sentences[-1]
+                sentences[-1] = (sentence, separator + match.group(0))
+                position = end
+            continue
+        sentences.append((stripped[position:start], match.group(0)))
+        position = end
+
+    if position < len(stripped):
+        sentences.append((stripped[position:], ''))
+
+    return prefix, sentences
+
+
+def split_long_sentence(sentence, max_length):
+    """Splits a sentence into pieces of at most ``max_length`` characters,
+    at the last whitespace before the limit, or right at the limit if there
+    is none (e.g., in Thai or in an unpunctuated paste).
+
+    :return: A list of ``(piece, separator)`` tuples, the last separator
+             being empty
+    """
+    pieces = []
+    while len(sentence) > max_length:
+        cut = None
+        for match in WHITESPACE.finditer(sentence, 1, max_length + 1):
+            cut = match.start()
+        if cut is None:
+            pieces.append((sentence[:max_length], ''))
+            sentence = sentence[max_length:]
+        else:
+            end = WHITESPACE.match(sentence, cut).end()
+            pieces.append((sentence[:cut], sentence[cut:end]))
+            sentence = sentence[end:]
+    pieces.append((sentence, ''))
+    return pieces
+
+
+def split_text(text, max_length=1000):
+    """Groups sentences into chunks of at most ``max_length`` characters.
+    A chunk never spans over a line break, so line and paragraph layouts are
+    preserved once the chunks are joined again. A single sentence longer
+    than ``max_length`` is split by :func:`split_long_sentence`.
+
+    :return: A tuple of the leading whitespace and a list of
+             ``(chunk, separator)`` tuples.
+    """
+    prefix, sentences = split_sentences(text)
+
+    pieces = []
+    for sentence, separator in sentences:
+        if len(sentence) > max_length:
+            split = split_long_sentence(sentence, max_length)
+            split[-1] = (split[-1][0], separator)
+            pieces.extend(split)
+        else:
+            pieces.append((sentence, separator))
+
+    chunks = []
+    buf = ''
+    for sentence, separator in pieces:
+        if buf and len(buf) + len(sentence) > max_length:
+            chunk, trailing = buf.rstrip(), buf[len(buf.rstrip()):]
+            chunks.append((chunk, trailing))
+            buf = ''
+
+        buf += sentence + separator
+        if '\n' in separator:
+            chunk, trailing = buf.rstrip(), buf[len(buf.rstrip()):]
+            chunks.append((chunk, trailing))
+            buf = ''
+
+    if buf:
+        chunk, trailing = buf.rstrip(), buf[len(buf.rstrip()):]
+        chunks.append((chunk, trailing))
+
+    return prefix, chunks
+
+
+def join_text(prefix, chunks, separators):
+    """Reverses :func:`split_text` given the (translated) chunks."""
+    return prefix + ''.join(
+        chunk + separator for chunk, separator in zip(chunks, separators))
@@ -6,3 +6,35 @@ def testapp():
     from app import create_app
     app = create_app(config={'DEBUG': True})
     return app.test_client()
+
+
+class FakeTranslate(object):
+    """Stands in for ``app.api.__translate__``, recording its calls as
+    ``(text, source, target)`` tuples."""
+
+    def __init__(self):
+        self.calls = []
+        #: Makes up a translation out of a text, a source and a target
+        self.respond = lambda text, source, target: text.upper()
+
+    def __call__(self, text, source, target, client, user_agent,
+                 deadline=None):
+        self.calls.append((text, source, target))
+        return self.respond(text, source, target)
+
+    @property
+    def texts(self):
+        return [text for text, _, _ in self.calls]
+
+
+@pytest.fixture
+def fake_translate(monkeypatch):
+    """Replaces the upstream translation with :class:`FakeTranslate`, with
+    the translation caches cleared."""
+    import app.api
+
+    fake = FakeTranslate()
+    monkeypatch.setattr(app.api, '__translate__', fake)
+    app.api.translation_cache.clear()
+    app.api.intermediate_cache.clear()
+    return fake
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import json
+import os
 
 
 def test_pages(testapp):
@@ -85,3 +86,76 @@ def test_version_check(testapp):
     result = json.loads(resp.get_data(as_text=True))
     assert not result['is_latest']
     assert 'latest_version' in result
+
+
+def test_languages_v1_3_etag(testapp):
+    url = '/api/v1.3/languages?locale=ko&field=target&sortby=0'
+    resp = testapp.get(url)
+    assert resp.status_code == 200
+    assert 'public' in resp.headers['Cache-Control']
+    etag = resp.headers['ETag']
+    assert not etag.startswith('W/')
+
+    resp = testapp.get(url, headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert not resp.data
+
+    resp = testapp.get('/api/v1.3/languages?locale=ko&field=intermediate')
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+
+
+def test_page_cache(testapp):
+    from app.main import invalidate_page_cache, page_cache
+
+    invalidate_page_cache()
+    resp = testapp.get('/credits?locale=en')
+    assert resp.status_code == 200
+    assert 1 == len(page_cache)
+
+    # Served from the cache
+    assert resp.data == testapp.get('/credits?locale=en').data
+    assert 1 == len(page_cache)
+
+    # Rendered again for other user agents
+    testapp.get('/credits?locale=en',
+                headers={'User-Agent': 'Mozilla/5.0 (iPhone)'})
+    assert 2 == len(page_cache)
+
+    # Query parameters that the page does not read share the cached page
+    testapp.get('/credits?locale=en&utm_source=test&fbclid=1')
+    testapp.get('/credits?locale=EN')
+    assert 2 == len(page_cache)
+
+    # Pages link to their own URLs, so HTTPS gets pages of its own
+    resp = testapp.get('/credits?locale=en', base_url='https://localhost')
+    assert 3 == len(page_cache)
+    assert b'http://localhost/' not in resp.data
+
+    invalidate_page_cache()
+    assert 0 == len(page_cache)
+
+
+def test_page_cache_redirect(testapp):
+    resp = testapp.get('/tr/unknown')
+    assert resp.status_code == 302
+    assert 302 == testapp.get('/tr/unknown').status_code
+
+    # The homepage reads ?tr=, so it cannot come from the cache
+    testapp.get('/?locale=en')
+    assert 302 == testapp.get('/?locale=en&tr=unknown').status_code
+
+
+def test_jinja_bytecode_cache(tmpdir, monkeypatch):
+    from app import create_app
+
+    directory = str(tmpdir.join('jinja'))
+    monkeypatch.setenv('JINJA_BYTECODE_CACHE_DIR', directory)
+    monkeypatch.setenv('PAGE_CACHE_ENABLED', 'false')
+    app = create_app(config={'DEBUG': True})
+    assert app.test_client().get('/about').status_code == 200
+    assert os.listdir(directory)
+
+    monkeypatch.setenv('JINJA_BYTECODE_CACHE', 'false')
+    app = create_app(config={'DEBUG': True})
+    assert app.jinja_env.bytecode_cache is None
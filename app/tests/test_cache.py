@@ -0,0 +1,84 @@
+import time
+
+from app.cache import LRUCache, SQLiteCache
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+
+    # 'b' is the least recently used entry at this point
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+    stats = cache.stats()
+    assert stats['hits'] == 3
+    assert stats['misses'] == 1
+    assert stats['evictions'] == 1
+
+
+def test_lru_cache_ttl():
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert cache.get('a', stale=True) == 1
+
+
+def test_sqlite_cache(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    key = (u'안녕하세요', '1', 'ko', 'en', 'x')
+    value = {'translated_text': 'Hello', 'intermediate_text': None}
+
+    cache = SQLiteCache(path, maxsize=2, ttl=60)
+    assert cache.get(key) is None
+    cache.set(key, value)
+    assert cache.get(key) == value
+
+    # Another worker (or a restarted one) sees the same entries
+    assert SQLiteCache(path, maxsize=2, ttl=60).get(key) == value
+
+
+def test_sqlite_cache_trim(tmpdir):
+    cache = SQLiteCache(str(tmpdir.join('cache.sqlite')), maxsize=2, ttl=60)
+    for i in range(3):
+        cache.set(('text', i), i)
+    assert cache.stats()['size'] == 3
+    cache.trim()
+
+    assert len(cache) == 2
+    assert cache.stats()['size'] == 2
+    assert cache.get(('text', 0)) is None
+    assert cache.get(('text', 2)) == 2
+    assert cache.stats()['evictions'] == 1
+
+
+def test_translate_cache(fake_translate):
+    import app.api
+    from app import create_app
+
+    with create_app().test_request_context():
+        for _ in range(2):
+            result = app.api.translate('cached text', '1', 'en', 'ko')
+            assert result['translated_text'] == 'CACHED TEXT'
+        app.api.translate('cached text', '1', 'en', 'ko', use_cache=False)
+
+    assert fake_translate.texts == ['cached text', 'cached text']
+
+
+def test_intermediate_cache_path(tmpdir, monkeypatch):
+    from app.cache import create_translation_cache
+
+    monkeypatch.setenv('CACHE_BACKEND', 'sqlite')
+    monkeypatch.setenv('CACHE_PATH', str(tmpdir.join('cache.sqlite')))
+    translation = create_translation_cache()
+    intermediate = create_translation_cache('intermediate')
+    assert intermediate.path == str(tmpdir.join('cache-intermediate.sqlite'))
+
+    translation.set('key', 'translation')
+    assert intermediate.get('key') is None
+    assert len(intermediate) == 0
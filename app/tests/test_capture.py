@@ -0,0 +1,88 @@
+import json
+import os
+
+import pytest
+
+from app import create_app
+from app.capture import redact
+
+
+@pytest.fixture
+def capturing_app(tmpdir, monkeypatch):
+    monkeypatch.setenv('CAPTURE_ENABLED', 'true')
+    monkeypatch.setenv('CAPTURE_DIRECTORY', str(tmpdir))
+    monkeypatch.setenv('CAPTURE_PATHS', '^(/api/v1.3/params|/v1.2/)')
+    return create_app(config={'DEBUG': True}).test_client()
+
+
+def read_records(tmpdir):
+    path = os.path.join(str(tmpdir), 'traffic-{}.jsonl'.format(os.getpid()))
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_capture(capturing_app, tmpdir):
+    capturing_app.get('/api/v1.3/languages?locale=en&field=source')
+    capturing_app.post('/api/v1.3/params', data={
+        'text': u'Hello, world!\n안녕 2', 'source': 'en',
+        'target': 'ko'})
+    capturing_app.get('/api/v1.3/params?text=Hi&source=en&target=ja')
+
+    records = read_records(tmpdir)
+    assert 2 == len(records)
+
+    first, second = records
+    assert 'POST' == first['method']
+    assert '/api/v1.3/params' == first['path']
+    assert {} == first['args']
+    assert first['json'] is None
+    assert {'text': [u'xxxxx, xxxxx!\nxx x'], 'source': ['en'],
+            'target': ['ko']} == first['form']
+    assert 200 == first['status']
+    assert first['duration'] >= 0
+
+    assert {'text': ['xx'], 'source': ['en'], 'target': ['ja']} == \
+        second['args']
+    assert first['timestamp'] <= second['timestamp']
+
+
+def test_capture_without_redaction(capturing_app, tmpdir, monkeypatch):
+    monkeypatch.setenv('CAPTURE_REDACT', 'false')
+    app = create_app(config={'DEBUG': True}).test_client()
+    app.get('/api/v1.3/params?text=Hi&source=en&target=ja')
+    assert ['Hi'] == read_records(tmpdir)[-1]['args']['text']
+
+
+def test_redact():
+    assert u'xxxx xx x xxxx.' == redact(u'This is a test.')
+    assert u'' == redact(u'')
+
+
+def test_capture_json(capturing_app, tmpdir, fake_translate):
+    body = {'t': ['Hello', 1], 'm': '1', 'sl': 'en', 'tl': 'ko'}
+    capturing_app.post('/v1.2/translate/batch', data=json.dumps(body),
+                       content_type='application/json')
+
+    record = read_records(tmpdir)[-1]
+    assert {} == record['form']
+    assert dict(body, t=['xxxxx', 1]) == record['json']
+    assert 200 == record['status']
+
+
+def test_capture_exception(capturing_app, tmpdir, monkeypatch):
+    import app.api
+
+    def fail(*args):
+        raise RuntimeError('Failed')
+
+    monkeypatch.setattr(app.api, '__params__', fail)
+    resp = create_app().test_client().get(
+        '/api/v1.3/params?text=Hi&source=en&target=ja')
+    assert 500 == resp.status_code
+    assert 500 == read_records(tmpdir)[-1]['status']
+
+
+def test_recorder_per_app(capturing_app, monkeypatch):
+    monkeypatch.delenv('CAPTURE_ENABLED')
+    assert not create_app().extensions['recorder'].enabled
+    assert capturing_app.application.extensions['recorder'].enabled
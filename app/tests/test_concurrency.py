@@ -0,0 +1,152 @@
+import threading
+import time
+
+from app.concurrency import Hedger, LatencyTracker, parallel_map, \
+    SingleFlight
+
+
+def test_parallel_map():
+    assert parallel_map(lambda x: x * 2, [3, 1, 2], 2) == [6, 2, 4]
+    assert parallel_map(lambda x: x, [], 2) == []
+
+
+def test_single_flight():
+    flights = SingleFlight()
+    calls = []
+    results = []
+
+    def slow_call(x):
+        calls.append(x)
+        time.sleep(0.1)
+        return x * 2
+
+    def worker():
+        results.append(flights.do('key', slow_call, (21,)))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [21]
+    assert results == [42] * 5
+    assert flights.stats() == {'calls': 5, 'coalesced': 4, 'in_flight': 0}
+
+
+def test_latency_tracker():
+    tracker = LatencyTracker(size=100)
+    assert tracker.percentile(95) is None
+    for i in range(200):
+        tracker.record(i)
+    assert tracker.percentile(50) == 150
+    assert tracker.percentile(100) == 199
+
+
+def test_hedger():
+    hedger = Hedger(max_rate=1.0, default_delay=0.05)
+
+    def slow():
+        time.sleep(0.5)
+        return 'primary'
+
+    assert hedger.call(slow, lambda: 'backup') == 'backup'
+    assert hedger.stats()['hedged'] == 1
+    assert hedger.stats()['backup_wins'] == 1
+
+
+def test_hedger_rate_cap():
+    hedger = Hedger(max_rate=0.0, default_delay=0.01)
+
+    def slow():
+        time.sleep(0.05)
+        return 'primary'
+
+    assert hedger.call(slow, lambda: 'backup') == 'primary'
+    assert hedger.stats()['hedged'] == 0
+
+
+def test_hedger_timeout():
+    import pytest
+    from app.utils import HTTPException
+
+    hedger = Hedger(max_rate=1.0, default_delay=0.01)
+
+    def slow():
+        time.sleep(0.2)
+
+    with pytest.raises(HTTPException) as e:
+        hedger.call(slow, slow, timeout=0.05)
+    assert e.value.status_code == 504
+
+
+def test_hedger_no_backup_past_timeout():
+    import pytest
+    from app.utils import HTTPException
+
+    hedger = Hedger(max_rate=1.0, default_delay=1.0)
+    backups = []
+
+    def slow():
+        time.sleep(0.2)
+
+    with pytest.raises(HTTPException) as e:
+        hedger.call(slow, lambda: backups.append(1), timeout=0.05)
+    assert e.value.status_code == 504
+    assert backups == []
+    assert hedger.stats()['hedged'] == 0
+
+
+def test_single_flight_interrupted():
+    import pytest
+    from app.utils import HTTPException
+
+    flights = SingleFlight()
+    started = threading.Event()
+    errors = []
+
+    def interrupted():
+        started.set()
+        time.sleep(0.05)
+        raise KeyboardInterrupt()
+
+    def leader():
+        try:
+            flights.do('key', interrupted)
+        except KeyboardInterrupt:
+            pass
+
+    def follower():
+        try:
+            flights.do('key', lambda: None, timeout=5)
+        except HTTPException as e:
+            errors.append(e.status_code)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait()
+    started_at = time.time()
+    follower()
+    thread.join()
+
+    assert errors == [503]
+    assert time.time() - started_at < 1
+    assert flights.stats()['in_flight'] == 0
+    with pytest.raises(KeyboardInterrupt):
+        flights.do('key', interrupted)
+
+
+def test_hedger_queueing(monkeypatch):
+    """Waiting for a thread of the executor is not taken as latency."""
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    import app.concurrency
+
+    monkeypatch.setattr(app.concurrency, '_executor', ThreadPoolExecutor(1))
+    monkeypatch.setattr(app.concurrency, '_executor_pid', os.getpid())
+    app.concurrency.get_executor().submit(time.sleep, 0.2)
+
+    hedger = Hedger(max_rate=1.0, default_delay=0.05)
+    assert hedger.call(lambda: 'primary', lambda: 'backup') == 'primary'
+    assert hedger.stats()['hedged'] == 0
+    assert hedger.latencies.percentile(50) < 0.05
@@ -0,0 +1,114 @@
+import gc
+import json
+import os
+import threading
+import time
+
+from app import metrics
+
+
+def test_counters_and_histograms():
+    labels = (('test', 'counters_and_histograms'),)
+
+    def record():
+        for _ in range(100):
+            metrics.increment('test_events_total', labels)
+            metrics.observe('test_latency_seconds', 0.02, labels)
+        metrics.observe('test_latency_seconds', 60, labels)
+
+    # Every thread records into its own shard
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    counters, histograms, _ = metrics.collect()
+    assert 400 == counters[('test_events_total', labels)]
+
+    histogram = histograms[('test_latency_seconds', labels)]
+    assert 400 == histogram[metrics.BUCKETS.index(0.025)]
+    assert 4 == histogram[len(metrics.BUCKETS)]
+    assert 404 == histogram[-1]
+
+
+def test_render():
+    labels = (('test', 'render'), ('quote', '"'))
+    metrics.increment('test_render_total', labels, 3)
+    metrics.observe('test_render_seconds', 0.3, labels)
+
+    text = metrics.render()
+    assert '# TYPE test_render_total counter' in text
+    assert 'test_render_total{test="render",quote="\\""} 3' in text
+
+    bucket = 'test_render_seconds_bucket{test="render",quote="\\"",le='
+    assert bucket + '"0.25"} 0' in text
+    assert bucket + '"0.5"} 1' in text
+    assert bucket + '"+Inf"} 1' in text
+    assert 'test_render_seconds_count{test="render",quote="\\""} 1' in text
+
+
+def test_multiple_processes(tmpdir, monkeypatch):
+    monkeypatch.setenv('METRICS_DIRECTORY', str(tmpdir))
+    labels = (('test', 'multiple_processes'),)
+    metrics.increment('test_processes_total', labels, 2)
+
+    # A snapshot written by another worker process
+    other = {
+        'counters': [['test_processes_total', [['test',
+                                                'multiple_processes']], 5]],
+        'histograms': [],
+        'gauges': [['test_gauge', [], 7]],
+    }
+    tmpdir.join('metrics-1.json').write(json.dumps(other))
+
+    counters, _, gauges = metrics.collect()
+    assert 7 == counters[('test_processes_total', labels)]
+    assert ('test_gauge', (('pid', '1'),), 7) in gauges
+
+
+def test_retired_shards():
+    from app.concurrency import parallel_map
+
+    labels = (('test', 'retired_shards'),)
+    for _ in range(50):
+        parallel_map(lambda _: metrics.increment('test_retired_total',
+                                                 labels),
+                     range(4), 4)
+    gc.collect()
+
+    # Shards of exited threads are merged, not kept around
+    assert len(metrics._shards) < 20
+    counters, _, _ = metrics.collect()
+    assert 200 == counters[('test_retired_total', labels)]
+
+
+def test_stale_snapshots(tmpdir, monkeypatch):
+    monkeypatch.setenv('METRICS_DIRECTORY', str(tmpdir))
+    monkeypatch.setenv('METRICS_FLUSH_INTERVAL', '1')
+    snapshot = json.dumps({'counters': [], 'histograms': [],
+                           'gauges': [['test_stale_gauge', [], 1]]})
+
+    # A worker that has exited (pids do not go this high), and one that has
+    # not written anything for a while
+    tmpdir.join('metrics-999999999.json').write(snapshot)
+    old = tmpdir.join('metrics-1.json')
+    old.write(snapshot)
+    os.utime(str(old), (time.time() - 10, time.time() - 10))
+
+    _, _, gauges = metrics.collect()
+    assert not [g for g in gauges if g[0] == 'test_stale_gauge']
+    assert ['metrics-{}.json'.format(os.getpid())] == \
+        os.listdir(str(tmpdir))
+
+
+def test_metrics_endpoint(testapp):
+    testapp.get('/api/v1.3/languages?locale=en&field=source')
+
+    resp = testapp.get('/metrics')
+    assert 200 == resp.status_code
+    text = resp.get_data(as_text=True)
+    assert 'translator_responses_total{endpoint="api.languages_v1_3",' \
+        'status="200"}' in text
+    assert 'translator_cache_hits{cache="translation",pid=' in text
+    assert 'translator_breaker_open{pid=' in text
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture
+def profiled_app(tmpdir, monkeypatch):
+    monkeypatch.setenv('PROFILING_TOKEN', 'secret')
+    monkeypatch.setenv('PROFILING_DIRECTORY', str(tmpdir))
+    monkeypatch.setenv('PROFILING_MAX_PER_MINUTE', '60')
+    return create_app(config={'DEBUG': True}).test_client()
+
+
+def test_profile_by_header(profiled_app, tmpdir):
+    url = '/api/v1.3/languages?locale=en&field=source'
+
+    profiled_app.get(url)
+    profiled_app.get(url, headers={'X-Profile': 'wrong'})
+    assert [] == os.listdir(str(tmpdir))
+
+    profiled_app.get(url, headers={'X-Profile': 'secret',
+                                   'X-Profile-Mode': 'both'})
+    files = sorted(os.listdir(str(tmpdir)))
+    assert 3 == len(files)
+    assert files[0].endswith('-cpu.txt')
+    assert files[1].endswith('-memory.txt')
+    assert files[2].endswith('.prof')
+    assert 'api.languages_v1_3' in files[0]
+
+
+def test_profiler_per_app(profiled_app, monkeypatch):
+    monkeypatch.delenv('PROFILING_TOKEN')
+    app = create_app(config={'DEBUG': True})
+    assert app.extensions['profiler'].token is None
+    assert 'secret' == \
+        profiled_app.application.extensions['profiler'].token
+
+
+def test_rate_cap(profiled_app, tmpdir):
+    for _ in range(3):
+        profiled_app.get('/api/v1.3/languages?locale=en&field=source',
+                         headers={'X-Profile': 'secret'})
+    assert 2 == len(os.listdir(str(tmpdir)))
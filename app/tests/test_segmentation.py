@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from app.segmentation import join_text, split_sentences, split_text
+
+
+def test_split_sentences():
+    prefix, sentences = split_sentences(u'  Hello. How are you?\n\nFine.')
+    assert prefix == u'  '
+    assert sentences == [(u'Hello.', u' '), (u'How are you?', u'\n\n'),
+                         (u'Fine.', u'')]
+
+
+def test_split_sentences_cjk():
+    prefix, sentences = split_sentences(u'日本語です。次の文。')
+    assert sentences == [(u'日本語です。', u''), (u'次の文。', u'')]
+
+
+def test_split_text():
+    text = u'\n One. Two. Three.\n\n  Four.  \n'
+    prefix, chunks = split_text(text, max_length=10)
+    assert chunks == [(u'One. Two.', u' '), (u'Three.', u'\n\n  '),
+                      (u'Four.', u'  \n')]
+
+    chunk_texts = [c for c, s in chunks]
+    separators = [s for c, s in chunks]
+    assert join_text(prefix, chunk_texts, separators) == text
+
+
+def test_split_long_sentence():
+    text = u'One two three four five six'
+    prefix, chunks = split_text(text, max_length=10)
+    assert chunks == [(u'One two', u' '), (u'three four', u' '),
+                      (u'five six', u'')]
+
+    # No whitespace to split at
+    prefix, chunks = split_text(u'x' * 25 + u'. Next.', max_length=10)
+    assert [c for c, s in chunks] == [u'x' * 10, u'x' * 10, u'xxxxx.',
+                                      u'Next.']
+    assert join_text(prefix, [c for c, s in chunks],
+                     [s for c, s in chunks]) == u'x' * 25 + u'. Next.'
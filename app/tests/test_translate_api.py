@@ -101,3 +101,128 @@ def test_translate_v1_3_1(testapp):
     assert 'programador' in sentences
     assert 'experiencia' in sentences
     assert 'otros' in sentences
+
+
+def test_translate_batch(testapp, fake_translate):
+    params = {'t': ['hello', 'world', 'hello', ''], 'm': '1',
+              'sl': 'en', 'tl': 'ko'}
+    resp = testapp.post('/v1.2/translate/batch', data=params)
+    assert resp.status_code == 200
+
+    translations = json.loads(resp.get_data(as_text=True))['translations']
+    assert [t.get('translated_text') for t in translations] == \
+        ['HELLO', 'WORLD', 'HELLO', None]
+    assert translations[3]['status_code'] == 400
+    assert sorted(fake_translate.texts) == ['hello', 'world']
+
+
+def test_translate_batch_json(testapp, fake_translate):
+    def post(body):
+        return testapp.post('/v1.2/translate/batch', data=json.dumps(body),
+                            content_type='application/json')
+
+    resp = post({'t': ['hello', 1, {}], 'm': '1', 'sl': 'en', 'tl': 'ko'})
+    assert resp.status_code == 200
+    translations = json.loads(resp.get_data(as_text=True))['translations']
+    assert translations[0]['translated_text'] == 'HELLO'
+    assert [t.get('status_code') for t in translations[1:]] == [400, 400]
+
+    assert post({'t': 'abc', 'm': '1', 'sl': 'en', 'tl': 'ko'}) \
+        .status_code == 400
+    assert post(['hello']).status_code == 400
+    assert fake_translate.texts == ['hello']
+
+
+def test_translate_batch_invalid_language(testapp):
+    params = {'t': ['hello'], 'm': '1', 'sl': 'en', 'tl': 'unknown'}
+    resp = testapp.post('/v1.2/translate/batch', data=params)
+    assert resp.status_code == 400
+
+
+def test_translate_longtext(testapp, fake_translate):
+    fake_translate.respond = lambda text, source, target: \
+        '<{}>'.format(text)
+
+    params = {'t': 'First line.\n\nSecond line. ' + 'x' * 2000,
+              'm': '2', 'sl': 'en', 'tl': 'ko'}
+    resp = testapp.post('/v1.2/translate/longtext', data=params)
+    assert resp.status_code == 200
+
+    data = json.loads(resp.get_data(as_text=True))
+    # The overlong sentence is cut in two, with nothing in between
+    assert data['intermediate_text'] == \
+        '<First line.>\n\n<Second line.> <{0}><{0}>'.format('x' * 1000)
+    assert data['translated_text'] == \
+        '<<First line.>>\n\n<<Second line.>> <<{0}>><<{0}>>'.format(
+            'x' * 1000)
+
+
+def test_translate_longtext_unpunctuated(testapp, fake_translate):
+    text = 'word ' * 1999 + 'word'
+    resp = testapp.post('/v1.2/translate/longtext',
+                        data={'t': text, 'm': '1', 'sl': 'en', 'tl': 'ko'})
+    assert resp.status_code == 200
+
+    data = json.loads(resp.get_data(as_text=True))
+    assert data['translated_text'] == text.upper()
+    assert max(len(t) for t in fake_translate.texts) <= 1000
+
+
+def test_translate_stream(testapp, fake_translate):
+    params = {'t': 'One. Two.\nThree.', 'm': '1', 'sl': 'en', 'tl': 'ko'}
+    resp = testapp.post('/v1.2/translate/stream', data=params)
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+
+    lines = resp.get_data(as_text=True).strip().split('\n')
+    items = sorted([json.loads(x) for x in lines], key=lambda x: x['index'])
+    assert [x['trans'] for x in items] == ['ONE.', 'TWO.', 'THREE.']
+    assert [x['sep'] for x in items] == [' ', '\n', '']
+
+
+def test_translate_stream_sse(testapp, fake_translate):
+    params = {'t': 'One.', 'm': '1', 'sl': 'en', 'tl': 'ko',
+              'format': 'sse'}
+    resp = testapp.post('/v1.2/translate/stream', data=params)
+    assert resp.mimetype == 'text/event-stream'
+
+    events = resp.get_data(as_text=True).strip().split('\n\n')
+    assert json.loads(events[0][len('data: '):])['trans'] == 'ONE.'
+    assert events[-1].startswith('event: done')
+
+
+def test_translate_multi(testapp, fake_translate):
+    fake_translate.respond = lambda text, source, target: \
+        '{}:{}'.format(target, text)
+
+    params = {'t': 'hello', 'm': '2', 'sl': 'en', 'tl': ['ko,es', 'fr']}
+    resp = testapp.post('/v1.2/translate/multi', data=params)
+    assert resp.status_code == 200
+
+    translations = json.loads(resp.get_data(as_text=True))['translations']
+    assert translations['ko']['translated_text'] == 'ko:ja:hello'
+    assert translations['fr']['intermediate_text'] == 'ja:hello'
+    assert fake_translate.calls.count(('hello', 'en', 'ja')) == 1
+    assert len(fake_translate.calls) == 4
+
+
+def test_parse_result(testapp):
+    raw = '[[["Hello.","Bonjour.",,,3],["world","monde",,,3]],,"fr",,,' \
+        '[["Bonjour",,[["Hello",1000,true,false]],[[0,7]]]]]'
+
+    resp = testapp.post('/api/v1.3/parse_result', data={'raw': raw})
+    assert 200 == resp.status_code
+    assert {'translated': 'Hello.world'} == \
+        json.loads(resp.get_data(as_text=True))
+
+    resp = testapp.post('/api/v1.3/parse_result', data={
+        'raw': raw, 'sections': 'sentences,source_language,phrases'})
+    assert 200 == resp.status_code
+    data = json.loads(resp.get_data(as_text=True))
+    assert 'Hello.world' == data['translated']
+    assert 'fr' == data['source_language']
+    assert 'Hello' == data['phrases'][0][2][0][0]
+
+    resp = testapp.post('/api/v1.3/parse_result', data={
+        'raw': raw, 'sections': 'dictionary'})
+    assert 400 == resp.status_code
@@ -0,0 +1,277 @@
+import time
+
+from app.upstream import get_session, load_proxies, ProxySelector, \
+    upstream_url
+
+
+def test_get_session():
+    """The same session should be reused within a process."""
+    assert get_session() is get_session()
+
+
+def test_get_session_pool_size(monkeypatch):
+    import app.upstream
+    monkeypatch.setenv('UPSTREAM_POOL_MAXSIZE', '3')
+    monkeypatch.setattr(app.upstream, '_session', None)
+
+    adapter = get_session().get_adapter('https://translate.google.com')
+    assert adapter._pool_maxsize == 3
+
+
+def test_get_lambda_client(monkeypatch):
+    import app.api
+    monkeypatch.setattr(app.api, '_lambda_clients', {})
+
+    client = app.api.get_lambda_client()
+    assert client is app.api.get_lambda_client()
+    assert client is not app.api.get_lambda_client('ap-northeast-2')
+
+    # A forked worker must not reuse the client of its parent
+    monkeypatch.setattr(app.api, '_lambda_clients_pid', -1)
+    assert client is not app.api.get_lambda_client()
+
+
+def test_proxy_selector():
+    selector = ProxySelector([('fast', None), ('slow', 'us-east-1')])
+    for _ in range(5):
+        selector.record('fast', 0.1)
+        selector.record('slow', 1.0)
+    assert all(selector.choose().name == 'fast' for _ in range(10))
+
+    selector.record('fast', 0.1, throttled=True)
+    assert selector.choose().name == 'slow'
+    assert selector.get('fast').serialize()['throttled']
+
+
+def test_load_proxies(monkeypatch):
+    monkeypatch.setenv('AWS_PROXIES', 'web_proxy, web_proxy3@eu-west-1')
+    assert load_proxies() == [('web_proxy', None),
+                              ('web_proxy3', 'eu-west-1')]
+
+
+class FakeLambdaClient(object):
+    """Answers invocations the way the web proxy function would."""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.invocations = []
+
+    def invoke(self, FunctionName, Payload, **kwargs):
+        import io
+        import json
+
+        time.sleep(self.latency)
+        payload = json.loads(Payload)
+        self.invocations.append(payload)
+        if 'requests' in payload:
+            content = {'responses': [{'text': r['url'], 'status_code': 200}
+                                     for r in payload['requests']]}
+        else:
+            content = {'text': payload['url'], 'status_code': 200}
+        body = json.dumps(content).encode('utf-8')
+        return {'StatusCode': 200, 'Payload': io.BytesIO(body)}
+
+
+def test_lambda_get_batch(monkeypatch):
+    import app.api
+
+    client = FakeLambdaClient()
+    monkeypatch.setattr(app.api, 'get_lambda_client',
+                        lambda region, budget=None: client)
+    monkeypatch.setenv('AWS_MAX_BATCH_SIZE', '2')
+
+    reqs = [{'url': 'http://example.com/{}'.format(i)} for i in range(5)]
+    responses = app.api.lambda_get_batch(reqs)
+
+    assert [r['text'] for r in responses] == [r['url'] for r in reqs]
+    assert len(client.invocations) == 3
+
+
+def test_lambda_get_hedged(monkeypatch):
+    """Hedged invocations must not wait for the pool they run on."""
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    import app.api
+    import app.concurrency
+    from app.concurrency import Hedger, parallel_map
+    from app.upstream import Deadline
+
+    client = FakeLambdaClient(latency=0.01)
+    monkeypatch.setattr(app.api, 'get_lambda_client',
+                        lambda region, budget=None: client)
+    monkeypatch.setattr(app.api, 'proxy_hedger', Hedger())
+    monkeypatch.setattr(app.concurrency, '_executor', ThreadPoolExecutor(4))
+    monkeypatch.setattr(app.concurrency, '_executor_pid', os.getpid())
+
+    started_at = time.time()
+    responses = parallel_map(
+        lambda i: app.api.lambda_get('http://example.com/{}'.format(i),
+                                     deadline=Deadline(2)),
+        range(8), 8)
+    assert [r['status_code'] for r in responses] == [200] * 8
+    assert time.time() - started_at < 1
+
+
+def test_lambda_client_timeouts(monkeypatch):
+    import app.api
+
+    monkeypatch.setenv('AWS_CONNECT_TIMEOUT', '3')
+    monkeypatch.setenv('DEADLINE_MAX', '20')
+    client = app.api.create_lambda_client('us-west-2')
+    assert client.meta.config.connect_timeout == 3
+    assert client.meta.config.read_timeout == \
+        20 + app.api.LAMBDA_READ_TIMEOUT_MARGIN
+
+    # Invocations get a read timeout that follows their remaining budget
+    monkeypatch.setattr(app.api, '_lambda_clients', {})
+    client = app.api.get_lambda_client('us-west-2', 2.5)
+    assert client.meta.config.read_timeout == 5
+    assert client is app.api.get_lambda_client('us-west-2', 2.9)
+    assert client is not app.api.get_lambda_client('us-west-2', 9)
+    assert app.api.get_lambda_client('us-west-2').meta.config \
+        .read_timeout == 20 + app.api.LAMBDA_READ_TIMEOUT_MARGIN
+
+
+def test_lambda_get_past_deadline(monkeypatch):
+    import pytest
+    import app.api
+    from app.upstream import Deadline
+    from app.utils import HTTPException
+
+    client = FakeLambdaClient(latency=0.1)
+    monkeypatch.setattr(app.api, 'get_lambda_client',
+                        lambda region, budget=None: client)
+    with pytest.raises(HTTPException) as e:
+        app.api.lambda_get('http://example.com', deadline=Deadline(0.05))
+    assert e.value.status_code == 504
+
+
+def test_decode_proxy_response():
+    import base64
+    import gzip
+    import io
+    import app.api
+
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(u'{"sentences": []}'.encode('utf-8'))
+    resp = {'body': base64.b64encode(buf.getvalue()).decode('ascii'),
+            'encoding': 'gzip+base64', 'status_code': 200}
+
+    assert app.api.__decode_proxy_response__(resp) == \
+        {'text': u'{"sentences": []}', 'status_code': 200}
+
+    resp = {'text': 'plain', 'status_code': 200}
+    assert app.api.__decode_proxy_response__(resp) == resp
+
+
+def test_deadline():
+    import pytest
+    from app.upstream import Deadline
+    from app.utils import HTTPException
+
+    assert 0 < Deadline(10).remaining() <= 10
+
+    with pytest.raises(HTTPException) as e:
+        Deadline(0).remaining()
+    assert e.value.status_code == 504
+
+
+def test_translate_deadline(testapp):
+    """An exhausted budget fails fast without going upstream."""
+    params = {'t': 'This should time out', 'm': '1', 'sl': 'en', 'tl': 'ko'}
+    resp = testapp.post('/v1.2/translate', data=params,
+                        headers={'X-Request-Timeout': '0'})
+    assert resp.status_code == 504
+
+
+def test_circuit_breaker():
+    from app.upstream import CircuitBreaker
+
+    breaker = CircuitBreaker(window=4, min_requests=4, cooldown=0.05,
+                             probe_successes=1)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.05)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_throttled():
+    from app.upstream import CircuitBreaker
+
+    breaker = CircuitBreaker(max_rate=8, min_rate=1)
+    breaker.record_failure(throttled=True)
+    assert breaker.is_open()
+    assert breaker.stats()['rate'] == 4
+    assert breaker.stats()['throttles'] == 1
+
+
+def test_circuit_breaker_pacing():
+    from app.upstream import CircuitBreaker
+
+    # A healthy upstream is not paced
+    breaker = CircuitBreaker(max_rate=50, cooldown=0, probe_successes=1)
+    assert all(breaker.allow() for _ in range(100))
+
+    # Until the rate is back to max_rate after throttling
+    breaker.record_failure(throttled=True)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert sum(breaker.allow() for _ in range(100)) < 50
+
+
+def test_translate_stale_cache(fake_translate, monkeypatch):
+    """A stale result is served whenever the circuit rejects a request."""
+    import app.api
+    from app import create_app
+
+    def reject(text, source, target):
+        raise app.api.CircuitOpenError()
+
+    fake_translate.respond = reject
+    monkeypatch.setattr(app.api.translation_cache, 'get',
+                        lambda key, default=None, stale=False:
+                        {'translated_text': 'stale'} if stale else default)
+    with create_app().test_request_context():
+        result = app.api.translate('hello', '1', 'en', 'ko')
+    assert result['translated_text'] == 'stale'
+
+
+def test_circuit_breaker_half_open_probes():
+    from app.upstream import CircuitBreaker
+
+    breaker = CircuitBreaker(cooldown=0.05, max_rate=50, probe_successes=3)
+    for _ in range(3):
+        breaker.record_failure(throttled=True)
+    assert breaker.stats()['rate'] == 6.25
+    assert breaker._bucket.capacity == 6.25
+
+    time.sleep(0.05)
+    assert sum(breaker.allow() for _ in range(100)) == 3
+
+    # A probe that comes back makes room for another one
+    breaker.record_success()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_upstream_url(monkeypatch):
+    assert 'http://translate.google.com/translate_a/t' == \
+        upstream_url('/translate_a/t')
+    assert 'https://translate.google.com/translate_a/single' == \
+        upstream_url('/translate_a/single', 'https')
+
+    monkeypatch.setenv('UPSTREAM_BASE_URL', 'http://localhost:8002/')
+    assert 'http://localhost:8002/translate_a/single' == \
+        upstream_url('/translate_a/single', 'https')
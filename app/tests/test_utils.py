@@ -1,4 +1,7 @@
-from app.utils import HTTPException
+import pytest
+
+from app.utils import HTTPException, parse_javascript, \
+    parse_javascript_sections
 
 
 def test_http_exception():
@@ -8,3 +11,44 @@ def test_http_exception():
     except HTTPException as e:
         assert 'An HTTP exception' == e.message
         assert 500 == e.status_code
+
+
+def test_parse_javascript():
+    assert [1, None, 2] == parse_javascript('[1,,2]')
+    assert [None, None, 1] == parse_javascript('[,,1]')
+    assert [1, None, None, None, None, 2] == parse_javascript('[1,,,,,2]')
+    assert [[None], 'en'] == parse_javascript('[[,],"en"]')
+    assert [1, None] == parse_javascript('[1,,]')
+
+
+def test_parse_javascript_strings():
+    assert ['a,,b', '[,', None] == parse_javascript('["a,,b","[,",,]')
+    assert ['say "hi",,', None, 1] == \
+        parse_javascript(r'["say \"hi\",,",,1]')
+    assert ['back\\', None, 1] == parse_javascript(r'["back\\",,1]')
+
+
+def test_parse_javascript_sections():
+    raw = '[[["Hello.","Bonjour."],[,,"[Hello, world]"]],[["noun"]],"fr",,,' \
+        '[["Bonjour",,[["Hello",1000]]]],0.9,,[["fr"],,[1.0],["fr"]]]'
+    expected = parse_javascript(raw)
+
+    sections = parse_javascript_sections(raw, [0, 2, 8])
+    assert {0: expected[0], 2: 'fr', 8: expected[8]} == sections
+
+    assert {3: None, 5: expected[5]} == \
+        parse_javascript_sections(raw, [3, 5])
+    assert {9: None} == parse_javascript_sections(raw, [9])
+
+
+def test_parse_javascript_sections_unterminated():
+    # The text is not scanned beyond the requested sections
+    assert {0: [1]} == parse_javascript_sections('[[1],[2', [0])
+
+    with pytest.raises(ValueError):
+        parse_javascript_sections('[[1],[2', [1])
+
+
+def test_parse_javascript_sections_deeply_nested():
+    raw = '[' + '[' * 12 + '"]"' + ']' * 12 + ',,"en"]'
+    assert {2: 'en'} == parse_javascript_sections(raw, [2])
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""HTTP client for the upstream translation service.
+
+A single :class:`requests.Session` is shared by all threads of a worker
+process so that consecutive translation requests reuse pooled keep-alive
+connections instead of paying a fresh TCP/TLS handshake every time.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import get_config
+from app.utils import HTTPException
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def upstream_url(path, scheme='http'):
+    """Returns the URL of ``path`` on Google Translate, or on the server set
+    by ``upstream.base_url`` (e.g., ``bin/fake_upstream.py`` for load
+    tests)."""
+    base_url = get_config('upstream', 'base_url') or \
+        '{}://translate.google.com'.format(scheme)
+    return base_url.rstrip('/') + path
+
+
+def create_session():
+    """Creates a session whose connection pools are sized by the
+    ``upstream.pool_connections`` (number of hosts to keep pools for) and
+    ``upstream.pool_maxsize`` (connections per host) settings."""
+    pool_connections = get_config('upstream', 'pool_connections', 10, int)
+    pool_maxsize = get_config('upstream', 'pool_maxsize', 10, int)
+
+    session = requests.Session()
+    for prefix in ('http://', 'https://'):
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+        session.mount(prefix, adapter)
+
+    return session
+
+
+def get_session():
+    """Returns the process-wide upstream session.
+
+    Sockets must not be shared across a ``fork()``, so a prefork worker
+    builds its own session the first time it is asked for one.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            _session = create_session()
+            _session_pid = pid
+
+    return _session
+
+
+def session_stats():
+    """Returns the statistics of the connection pools of the upstream
+    session, one per host."""
+    stats = []
+    for adapter in get_session().adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats.append({
+                'host': pool.host,
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': pool.pool.qsize() if pool.pool is not None else 0,
+            })
+    return stats
+
+
+class Deadline(object):
+    """An end-to-end time budget for a request, shared by all of its upstream
+    legs (which may run in other threads)."""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires_at = time.time() + timeout
+
+    def remaining(self):
+        """Returns the remaining budget in seconds, or raises an
+        :class:`HTTPException` (504) if nothing is left."""
+        remaining = self.expires_at - time.time()
+        if remaining <= 0:
+            raise HTTPException('Request timed out.', 504)
+        return remaining
+
+
+def remaining_time(deadline, default=None):
+    """Returns the remaining budget of ``deadline``, or ``default`` if there
+    is no deadline."""
+    return default if deadline is None else deadline.remaining()
+
+
+class CircuitOpenError(HTTPException):
+    """Raised when the circuit breaker rejects an upstream request."""
+
+    def __init__(self):
+        super(CircuitOpenError, self).__init__(
+            'Translation service is temporarily unavailable.', 503)
+
+
+class TokenBucket(object):
+    """Allows ``rate`` events per second on average, with bursts of up to
+    ``capacity`` events."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.time()
+
+    def take(self):
+        now = time.time()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class CircuitBreaker(object):
+    """Stops sending requests to an upstream that is throttling us or
+    failing.
+
+    The circuit opens as soon as the upstream throttles (e.g., HTTP 429 or a
+    CAPTCHA page), or once the error rate of the last ``window`` requests
+    reaches ``error_threshold``. While open, requests are rejected right
+    away. After ``cooldown`` seconds, it is half-open: up to
+    ``probe_successes`` probe requests may be in flight at a time, and
+    ``probe_successes`` consecutive successes close it again, whereas a
+    single failure re-opens it.
+
+    Once the upstream has throttled us, requests are also paced by a token
+    bucket whose rate adapts to the upstream: it is halved whenever the
+    upstream throttles (down to ``min_rate``) and grows with every success
+    by 10% or ``min_rate``, whichever is larger, so that it recovers from
+    ``min_rate`` in a reasonable number of requests. Bursts are capped at
+    a second's worth of the current rate. Pacing stops once the circuit is
+    closed and the rate is back to ``max_rate``, so that a healthy upstream
+    gets all of our traffic.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, window=20, min_requests=10, error_threshold=0.5,
+                 cooldown=30.0, max_rate=50.0, min_rate=0.5,
+                 probe_successes=3):
+        self.min_requests = min_requests
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.probe_successes = probe_successes
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.rejected = 0
+        self.throttles = 0
+        self._successes = 0
+        self._probes = 0
+        self._outcomes = deque(maxlen=window)
+        self._bucket = TokenBucket(max_rate)
+        self._lock = threading.Lock()
+
+    def error_rate(self):
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / float(len(self._outcomes))
+
+    def is_open(self):
+        """Indicates whether requests are being rejected for now."""
+        return self.state == self.OPEN and \
+            time.time() < self.opened_at + self.cooldown
+
+    def allow(self):
+        """Indicates whether a request may be sent now."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.time() < self.opened_at + self.cooldown:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._successes = 0
+                self._probes = 0
+
+            half_open = self.state == self.HALF_OPEN
+            paced = self.state != self.CLOSED or \
+                self._bucket.rate < self.max_rate
+            if (half_open and self._probes >= self.probe_successes) or \
+                    (paced and not self._bucket.take()):
+                self.rejected += 1
+                return False
+            if half_open:
+                self._probes += 1
+            return True
+
+    def _set_rate(self, rate):
+        bucket = self._bucket
+        bucket.rate = rate
+        bucket.capacity = max(1, rate)
+        bucket.tokens = min(bucket.tokens, bucket.capacity)
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.time()
+        self._outcomes.clear()
+
+    def record_success(self):
+        with self._lock:
+            self._outcomes.append(True)
+            self._set_rate(min(
+                self.max_rate,
+                self._bucket.rate + max(self.min_rate,
+                                        0.1 * self._bucket.rate)))
+            if self.state == self.HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                self._successes += 1
+                if self._successes >= self.probe_successes:
+                    self.state = self.CLOSED
+
+    def record_failure(self, throttled=False):
+        with self._lock:
+            self._outcomes.append(False)
+            if throttled:
+                self.throttles += 1
+                self._set_rate(max(self.min_rate, self._bucket.rate / 2.0))
+
+            if self.state == self.HALF_OPEN or throttled or (
+                    len(self._outcomes) >= self.min_requests and
+                    self.error_rate() >= self.error_threshold):
+                self._open()
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'rate': self._bucket.rate,
+            'error_rate': self.error_rate(),
+            'rejected': self.rejected,
+            'throttles': self.throttles,
+        }
+
+
+def create_circuit_breaker():
+    """Creates a :class:`CircuitBreaker` as configured in the ``breaker``
+    section."""
+    return CircuitBreaker(
+        window=get_config('breaker', 'window', 20, int),
+        min_requests=get_config('breaker', 'min_requests', 10, int),
+        error_threshold=get_config('breaker', 'error_threshold', 0.5, float),
+        cooldown=get_config('breaker', 'cooldown', 30, float),
+        max_rate=get_config('breaker', 'max_rate', 50, float),
+        min_rate=get_config('breaker', 'min_rate', 0.5, float),
+        probe_successes=get_config('breaker', 'probe_successes', 3, int))
+
+
+def is_throttled(resp):
+    """Indicates whether an upstream response means we are being throttled,
+    either with an HTTP status or with a CAPTCHA page (see ``/captcha``)."""
+    if resp.status_code in (429, 503):
+        return True
+    if '/sorry/' in resp.url:
+        return True
+    content_type = resp.headers.get('Content-Type', '')
+    return content_type.startswith('text/html') and \
+        'unusual traffic' in resp.text
+
+
+class ProxyStats(object):
+    """Exponentially weighted moving averages of the latency and the error
+    rate observed for a single AWS Lambda web proxy function."""
+
+    def __init__(self, name, region=None):
+        self.name = name
+        self.region = region
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.throttles = 0
+        self.throttled_until = 0
+
+    def score(self, error_penalty):
+        """Lower is better. A proxy that has never been used scores zero so
+        that it gets tried."""
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + error_penalty * self.error_rate)
+
+    def serialize(self):
+        return {
+            'name': self.name,
+            'region': self.region,
+            'latency': self.latency,
+            'error_rate': self.error_rate,
+            'requests': self.requests,
+            'errors': self.errors,
+            'throttles': self.throttles,
+            'throttled': self.throttled_until > time.time(),
+        }
+
+
+class ProxySelector(object):
+    """Picks a web proxy by comparing two randomly chosen proxies and taking
+    the one with the lower EWMA latency, weighted by its error rate. A
+    throttled proxy is left out for ``throttle_cooldown`` seconds, unless
+    every proxy is throttled.
+
+    :param proxies: A list of ``(name, region)`` tuples
+    """
+
+    def __init__(self, proxies, alpha=0.2, error_penalty=10.0,
+                 throttle_cooldown=10.0):
+        if not proxies:
+            raise ValueError('At least one proxy is required')
+        self.proxies = [ProxyStats(name, region) for name, region in proxies]
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.throttle_cooldown = throttle_cooldown
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        for proxy in self.proxies:
+            if proxy.name == name:
+                return proxy
+        raise KeyError(name)
+
+    def choose(self, exclude=()):
+        """Returns the :class:`ProxyStats` of the proxy to use next.
+
+        :param exclude: Names of proxies to avoid if possible
+        """
+        now = time.time()
+        candidates = [p for p in self.proxies if p.name not in exclude
+                      and p.throttled_until <= now]
+        if not candidates:
+            candidates = [p for p in self.proxies if p.name not in exclude] \
+                or self.proxies
+
+        if len(candidates) == 1:
+            return candidates[0]
+
+        first, second = random.sample(candidates, 2)
+        if first.score(self.error_penalty) <= \
+                second.score(self.error_penalty):
+            return first
+        else:
+            return second
+
+    def record(self, name, latency, error=False, throttled=False):
+        """Records the outcome of a request sent through a proxy."""
+        with self._lock:
+            proxy = self.get(name)
+            proxy.requests += 1
+            if error or throttled:
+                proxy.errors += 1
+            if throttled:
+                proxy.throttles += 1
+                proxy.throttled_until = time.time() + self.throttle_cooldown
+
+            sample = 1.0 if (error or throttled) else 0.0
+            proxy.error_rate += self.alpha * (sample - proxy.error_rate)
+            if proxy.latency is None:
+                proxy.latency = latency
+            else:
+                proxy.latency += self.alpha * (latency - proxy.latency)
+
+    def stats(self):
+        return [proxy.serialize() for proxy in self.proxies]
+
+
+def load_proxies():
+    """Reads the registry of web proxy functions from ``aws.proxies``.
+
+    In ``config.yml``, the registry is a list of ``{name: ..., region: ...}``
+    mappings; ``region`` may be omitted to use the default region. The
+    ``AWS_PROXIES`` environment variable takes a comma-separated list of
+    ``name`` or ``name@region`` instead.
+
+    :return: A list of ``(name, region)`` tuples
+    """
+    proxies = get_config('aws', 'proxies') or ['web_proxy', 'web_proxy2']
+    if isinstance(proxies, str):
+        proxies = [p.strip() for p in proxies.split(',') if p.strip()]
+
+    registry = []
+    for proxy in proxies:
+        if isinstance(proxy, dict):
+            registry.append((proxy['name'], proxy.get('region')))
+        else:
+            name, _, region = proxy.partition('@')
+            registry.append((name, region or None))
+    return registry
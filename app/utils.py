@@ -7,6 +7,7 @@ from app import VALID_LANGUAGES
 import uuid
 import base62
 import json
+import re
 
 
 class HTTPException(RuntimeError):
@@ -81,10 +82,122 @@ def language_options_html():
     return '\n'.join(['<option value="%s">%s</option>' % (k, v) for k, v in sorted_tuples])
 
 
+def __fill_elided__(code):
+    if '[,' in code:
+        code = code.replace('[,', '[null,')
+    # ',,,' becomes ',null,,' in the first pass, hence the loop
+    while ',,' in code:
+        code = code.replace(',,', ',null,')
+    if ',]' in code:
+        code = code.replace(',]', ']')
+    return code
+
+
 def parse_javascript(text):
-    # NOTE: This may not work in some cases...
-    text = text.replace(',,,', ',null,null,')
-    text = text.replace(',,', ',null,')
-    text = text.replace('[,', '[null,')
+    """Parses a JavaScript array literal as Google Translate returns it,
+    where elided elements (e.g., ``[1,,2]``) stand for nulls.
 
+    Elided elements are filled in only outside string literals, so their
+    contents are never altered. A trailing comma does not make an element,
+    as in JavaScript.
+
+    This is a correctness fix rather than an optimization: client=t
+    responses always elide elements, and telling string literals apart
+    makes them about 1.7 times as costly to parse as blindly replacing
+    ``,,`` used to (see ``bin/benchmark.py parse-javascript``).
+    """
+    # Plain JSON (nothing elided) needs no rewriting at all
+    if ',,' not in text and '[,' not in text and ',]' not in text:
+        return json.loads(text)
+
+    # Raw control characters are not allowed in JSON, so they can stand for
+    # escape sequences and string literals while the code is rewritten
+    escaped = '\\' in text
+    if escaped:
+        text = text.replace('\\\\', '\x01').replace('\\"', '\x02')
+
+    # Items at even indices are outside string literals
+    parts = text.split('"')
+    parts[0::2] = __fill_elided__('\x00'.join(parts[0::2])).split('\x00')
+    text = '"'.join(parts)
+
+    if escaped:
+        text = text.replace('\x02', '\\"').replace('\x01', '\\\\')
     return json.loads(text)
+
+
+# A string literal, and a run of characters (string literals included) up
+# to the next bracket
+STRING_LITERAL = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+BRACKET = re.compile(
+    r'[^"\[\]]*(?:' + STRING_LITERAL + r'[^"\[\]]*)*')
+
+# A run of characters (string literals included) up to the next delimiter
+# of an array element
+ELEMENT_END = re.compile(
+    r'[^"\[\],]*(?:' + STRING_LITERAL + r'[^"\[\],]*)*')
+
+
+def __nested_array_pattern__(depth):
+    """Builds a pattern that matches an array nested at most ``depth`` levels
+    deep, so that the regex engine skips over it in one go."""
+    pattern = r'\[' + BRACKET.pattern + r'\]'
+    for _ in range(depth - 1):
+        pattern = r'\[{0}(?:{1}{0})*\]'.format(BRACKET.pattern, pattern)
+    return re.compile(pattern)
+
+
+NESTED_ARRAY = __nested_array_pattern__(8)
+
+
+def __skip_element__(text, pos):
+    """Returns the position of the ',' or ']' that ends the array element
+    starting at ``pos``."""
+    depth = 0
+    while True:
+        pattern = BRACKET if depth else ELEMENT_END
+        pos = pattern.match(text, pos).end()
+        if pos >= len(text):
+            raise ValueError('Unterminated array')
+        elif text[pos] == '[':
+            # Arrays nested too deeply are walked through bracket by bracket
+            match = NESTED_ARRAY.match(text, pos)
+            if match:
+                pos = match.end()
+                continue
+            depth += 1
+        elif text[pos] == ']':
+            if not depth:
+                return pos
+            depth -= 1
+        elif not depth:
+            return pos
+        pos += 1
+
+
+def parse_javascript_sections(text, indices):
+    """Parses only the given elements of the top-level array of a
+    JavaScript array literal (see :func:`parse_javascript`). The text is
+    scanned no further than the last element asked for, and the elements in
+    between are skipped without being parsed.
+
+    :param indices: Indices of the elements to parse
+    :return: A dictionary of indices to elements; an index beyond the end of
+             the array maps to ``None``
+    """
+    indices = set(indices)
+    sections = dict((index, None) for index in indices)
+
+    pos = text.index('[') + 1
+    last = max(indices) if indices else -1
+    for index in range(last + 1):
+        end = __skip_element__(text, pos)
+        if index in indices:
+            element = text[pos:end].strip()
+            if element:
+                sections[index] = parse_javascript(element)
+        if text[end] == ']':
+            break
+        pos = end + 1
+
+    return sections
@@ -0,0 +1,414 @@
+"""Benchmarks for performance-sensitive helpers.
+
+    PYTHONPATH=. python bin/benchmark.py parse-javascript
+    PYTHONPATH=. python bin/benchmark.py parse-result
+    PYTHONPATH=. python bin/benchmark.py startup
+    PYTHONPATH=. python bin/benchmark.py suite [--save]
+
+The first ``suite`` run records a baseline of this machine in
+bin/benchmark-baseline.json, which is not committed as timings are only
+comparable on the same machine and Python version; later runs compare with
+it. On a shared single-CPU machine, results of the suite varied by up to
+40% between runs, below its default threshold of 50%.
+"""
+
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import timeit
+
+import click
+
+from app.utils import parse_javascript, parse_javascript_sections
+
+
+def parse_javascript_legacy(text):
+    """The implementation of :func:`app.utils.parse_javascript` prior to the
+    string-aware scanner, kept as a baseline."""
+    text = text.replace(',,,', ',null,null,')
+    text = text.replace(',,', ',null,')
+    text = text.replace('[,', '[null,')
+
+    return json.loads(text)
+
+
+def to_javascript(value):
+    """Serializes a value the way Google Translate does, eliding nulls in
+    arrays."""
+    if isinstance(value, list):
+        return '[' + ','.join(
+            '' if x is None else to_javascript(x) for x in value) + ']'
+    return json.dumps(value, ensure_ascii=False)
+
+
+def random_text(rand, words):
+    vocabulary = ['translation', 'better', 'google', 'sentence', 'language',
+                  'phrase', u'안녕하세요', u'翻訳',
+                  'the', 'a', 'of', 'quoted "word"', 'back\\slash']
+    return ' '.join(rand.choice(vocabulary) for _ in range(words))
+
+
+def generate_response(sentences, seed=0):
+    """Generates a response shaped like that of ``client=t`` with the given
+    number of sentences, along with dictionary, phrase and language
+    detection sections.
+
+    :return: The response as a Python value (nulls included)
+    """
+    rand = random.Random(seed)
+
+    sentence_section = [
+        [random_text(rand, 12) + '.', random_text(rand, 10) + '.', None,
+         None, rand.randint(0, 3)]
+        for _ in range(sentences)]
+    sentence_section.append([None, None, random_text(rand, 20)])
+
+    dictionary_section = [
+        [rand.choice(['noun', 'verb', 'adjective']),
+         [random_text(rand, 1) for _ in range(5)],
+         [[random_text(rand, 1), [random_text(rand, 1) for _ in range(3)],
+           None, rand.random()] for _ in range(5)],
+         random_text(rand, 1), rand.randint(1, 3)]
+        for _ in range(max(1, sentences // 4))]
+
+    phrase_section = [
+        [random_text(rand, 2), None,
+         [[random_text(rand, 2), rand.randint(0, 1000), True, False]
+          for _ in range(4)],
+         [[0, 10]], random_text(rand, 4), 0, 10]
+        for _ in range(sentences * 2)]
+
+    return [sentence_section, dictionary_section, 'en', None, None,
+            phrase_section, rand.random(), None,
+            [['en'], None, [rand.random()], ['en']]]
+
+
+def measure(func, arg, repeat, number, summary=min):
+    """Returns the time per call in milliseconds.
+
+    :param summary: How to summarize the repeats; the best one by default
+    """
+    timer = timeit.Timer(lambda: func(arg))
+    return summary(timer.repeat(repeat=repeat, number=number)) / number * 1000
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command('parse-javascript')
+@click.option('--sentences', '-s', multiple=True, type=int,
+              default=[1, 10, 100, 1000])
+@click.option('--repeat', type=int, default=5)
+@click.option('--number', type=int, default=20)
+def bench_parse_javascript(sentences, repeat, number):
+    """Compares parse_javascript with the legacy implementation on
+    client=t responses of various sizes. The legacy implementation is
+    faster but mangles string literals containing ``,,``; the cost column
+    is how many times as long the current one takes."""
+    click.echo('{:>10} {:>10} {:>12} {:>12} {:>8}'.format(
+        'sentences', 'bytes', 'legacy (ms)', 'current (ms)', 'cost'))
+
+    for n in sentences:
+        value = generate_response(n)
+        raw = to_javascript(value)
+        assert parse_javascript(raw) == value
+
+        legacy = measure(parse_javascript_legacy, raw, repeat, number)
+        current = measure(parse_javascript, raw, repeat, number)
+        click.echo('{:>10} {:>10} {:>12.3f} {:>12.3f} {:>7.2f}x'.format(
+            n, len(raw.encode('utf-8')), legacy, current, current / legacy))
+
+
+@cli.command('parse-result')
+@click.option('--sentences', '-s', multiple=True, type=int,
+              default=[1, 10, 100, 1000])
+@click.option('--sections', default='0',
+              help='Comma-separated indices of the sections to extract')
+@click.option('--repeat', type=int, default=5)
+@click.option('--number', type=int, default=20)
+def bench_parse_result(sentences, sections, repeat, number):
+    """Compares extracting some sections of a client=t response by parsing
+    all of it with extracting them selectively."""
+    indices = [int(x) for x in sections.split(',')]
+
+    def full(raw):
+        parsed = parse_javascript(raw)
+        return dict((i, parsed[i] if i < len(parsed) else None)
+                    for i in indices)
+
+    def selective(raw):
+        return parse_javascript_sections(raw, indices)
+
+    click.echo('{:>10} {:>10} {:>12} {:>15} {:>8}'.format(
+        'sentences', 'bytes', 'full (ms)', 'selective (ms)', 'speedup'))
+
+    for n in sentences:
+        raw = to_javascript(generate_response(n))
+        assert full(raw) == selective(raw)
+
+        full_time = measure(full, raw, repeat, number)
+        selective_time = measure(selective, raw, repeat, number)
+        click.echo('{:>10} {:>10} {:>12.3f} {:>15.3f} {:>7.2f}x'.format(
+            n, len(raw.encode('utf-8')), full_time, selective_time,
+            full_time / selective_time))
+
+
+#: Starts the app in a fresh process and serves a single request
+STARTUP_SCRIPT = """
+import json, sys, time
+started_at = time.time()
+from app import create_app
+app = create_app()
+created_at = time.time()
+status_code = app.test_client().get(sys.argv[1]).status_code
+served_at = time.time()
+print(json.dumps({
+    'create_app': created_at - started_at,
+    'first_request': served_at - created_at,
+    'status_code': status_code,
+}))
+"""
+
+
+def parse_importtime(output):
+    """Parses the output of ``python -X importtime``.
+
+    :return: A list of ``(module, self time, cumulative time)`` tuples, in
+             seconds
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((module.strip(), int(self_time) / 1e6,
+                        int(cumulative) / 1e6))
+    return imports
+
+
+@cli.command('startup')
+@click.option('--path', default='/', help='Path of the first request')
+@click.option('--runs', type=int, default=3)
+@click.option('--top', type=int, default=15,
+              help='Number of the slowest imports to show')
+def bench_startup(path, runs, top):
+    """Measures how long it takes for a new worker process to create the
+    app and to serve its first request, with a breakdown of the slowest
+    imports (requires Python 3.7 or later). The first run may compile
+    templates that later runs load from the Jinja bytecode cache."""
+    env = dict(os.environ, PYTHONWARNINGS='ignore')
+
+    click.echo('{:>4} {:>16} {:>18} {:>8}'.format(
+        'run', 'create_app (ms)', 'first request (ms)', 'status'))
+    for run in range(runs):
+        proc = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT, path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+            universal_newlines=True)
+        stdout, stderr = proc.communicate()
+        if proc.returncode != 0:
+            raise click.ClickException(stderr)
+
+        result = json.loads(stdout.strip().splitlines()[-1])
+        click.echo('{:>4} {:>16.1f} {:>18.1f} {:>8}'.format(
+            run + 1, result['create_app'] * 1000,
+            result['first_request'] * 1000, result['status_code']))
+
+    imports = parse_importtime(stderr)
+    click.echo('\nSlowest imports (last run), {:.1f} ms in total:'.format(
+        sum(x[1] for x in imports) * 1000))
+    click.echo('{:>10} {:>16}  {}'.format('self (ms)', 'cumulative (ms)',
+                                          'module'))
+    for module, self_time, cumulative in sorted(
+            imports, key=lambda x: x[2], reverse=True)[:top]:
+        click.echo('{:>10.1f} {:>16.1f}  {}'.format(
+            self_time * 1000, cumulative * 1000, module))
+
+
+#: Results of the first ``suite`` run or of ``suite --save``, which later
+#: runs compare with. It is specific to the machine, hence not committed.
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'benchmark-baseline.json')
+
+
+def random_sentences(length, seed=0):
+    """Returns a text of about ``length`` characters, mixing scripts."""
+    rand = random.Random(seed)
+    sentences = []
+    while sum(len(x) + 1 for x in sentences) < length:
+        sentences.append(random_text(rand, rand.randint(5, 15)) + '.')
+    return ' '.join(sentences)[:length]
+
+
+def suite_cases():
+    """Yields ``(name, func, arg)`` for every micro-benchmark of the suite.
+    Payloads are generated with fixed seeds, so that every run measures the
+    same inputs. Functions that need a request context are called in the
+    one that :func:`bench_suite` pushes."""
+    from app.api import __params__
+    from app.utils import language_options_html
+    from data import extract_phrases, extract_sentences
+
+    for n in (1, 10, 100, 1000):
+        raw = to_javascript(generate_response(n, seed=n))
+        yield 'parse_javascript/{}'.format(n), parse_javascript, raw
+        yield 'parse_javascript_sections/{}'.format(n), \
+            lambda x: parse_javascript_sections(x, [0, 2]), raw
+
+    for length in (100, 1000, 8000):
+        text = random_sentences(length, seed=length)
+        yield '__params__/{}'.format(length), \
+            lambda x: __params__(x, 'en', 'ko'), text
+
+    yield 'language_options_html', lambda _: language_options_html(), None
+
+    for n in (10, 100, 1000):
+        value = generate_response(n, seed=n)
+        yield 'extract_sentences/{}'.format(n), \
+            lambda x: list(extract_sentences(x)), value[0]
+        yield 'extract_phrases/{}'.format(n), \
+            lambda x: list(extract_phrases(x)), value[5]
+
+
+def suite_context():
+    """Returns the request context the suite runs in."""
+    from app import create_app
+
+    return create_app().test_request_context(
+        '/?locale=en', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+
+
+def calibrate(func, arg, duration=0.1):
+    """Returns how many calls take about ``duration`` seconds."""
+    timer = timeit.Timer(lambda: func(arg))
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= duration or number >= 1000000:
+            return number
+        number = max(number * 2,
+                     int(number * duration / max(elapsed, 1e-9)))
+
+
+@cli.command('measure-cases', hidden=True)
+@click.option('--filter', 'pattern', default='')
+@click.option('--repeat', type=int, default=7)
+def bench_measure_cases(pattern, repeat):
+    """Prints the median time per call of the benchmarks of the suite, in
+    milliseconds, as JSON."""
+    results = {}
+    with suite_context():
+        for name, func, arg in suite_cases():
+            if pattern in name:
+                number = calibrate(func, arg)
+                results[name] = measure(func, arg, repeat, number, median)
+    click.echo(json.dumps(results))
+
+
+def run_suite(pattern, repeat, runs):
+    """Runs the suite in ``runs`` fresh processes, as some processes run as
+    much as twice as slow as others on shared machines.
+
+    :return: A dictionary of the median over the runs of the time per call
+             of each benchmark, in milliseconds
+    """
+    env = dict(os.environ, PYTHONWARNINGS='ignore')
+    measurements = {}
+    for run in range(runs):
+        click.echo('Run {} of {}...'.format(run + 1, runs), err=True)
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), 'measure-cases',
+             '--filter', pattern, '--repeat', str(repeat)],
+            env=env, universal_newlines=True)
+        for name, value in json.loads(output.splitlines()[-1]).items():
+            measurements.setdefault(name, []).append(value)
+    return dict((name, median(values))
+                for name, values in measurements.items())
+
+
+@cli.command('suite')
+@click.option('--filter', 'pattern', default='',
+              help='Runs only the benchmarks whose names contain this')
+@click.option('--repeat', type=int, default=7)
+@click.option('--runs', type=int, default=5,
+              help='Number of processes to run the benchmarks in')
+@click.option('--threshold', type=float, default=0.5,
+              help='Slowdown relative to the baseline that is reported as '
+                   'a regression (0.5 for 50%), which must be above the '
+                   'run-to-run noise of the machine')
+@click.option('--baseline', default=BASELINE_PATH)
+@click.option('--save', is_flag=True,
+              help='Stores the results as the new baseline')
+def bench_suite(pattern, repeat, runs, threshold, baseline, save):
+    """Runs micro-benchmarks of the hot-path helpers and compares them with
+    the stored baseline. Each benchmark is timed by the median of its
+    repeats in a process, then of the runs. Exits with status 1 if any of
+    them regressed. If there is no baseline yet, the results are stored as
+    one. Baselines are only comparable on the same machine and Python
+    version, so a baseline taken elsewhere is reported but not failed on.
+    """
+    try:
+        with open(baseline) as f:
+            stored = json.load(f)
+    except IOError:
+        stored = {'results': {}}
+        save = True
+
+    environment = {'python': platform.python_version(),
+                   'machine': platform.machine(),
+                   'system': platform.system()}
+    comparable = stored.get('environment', environment) == environment
+    if not comparable:
+        click.echo('Warning: the baseline was taken on {}; run with --save '
+                   'to replace it'.format(stored['environment']), err=True)
+
+    results = run_suite(pattern, repeat, runs)
+    regressions = []
+
+    click.echo('{:<32} {:>12} {:>12} {:>8}'.format(
+        'benchmark', 'time (ms)', 'baseline', 'change'))
+    for name, _, _ in suite_cases():
+        if name not in results:
+            continue
+
+        previous = stored['results'].get(name)
+        if previous is None:
+            click.echo('{:<32} {:>12.4f} {:>12} {:>8}'.format(
+                name, results[name], '-', '-'))
+            continue
+
+        change = results[name] / previous - 1
+        flag = ''
+        if change > threshold and comparable:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        click.echo('{:<32} {:>12.4f} {:>12.4f} {:>+7.1f}%{}'.format(
+            name, results[name], previous, change * 100, flag))
+
+    if save:
+        stored['environment'] = environment
+        stored['results'] = dict(stored['results'], **results)
+        with open(baseline, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write('\n')
+        click.echo('Saved the baseline to {}'.format(baseline))
+    elif regressions:
+        raise click.ClickException('{} regressed by more than {:.0f}%'.format(
+            ', '.join(regressions), threshold * 100))
+
+
+if __name__ == '__main__':
+    cli()
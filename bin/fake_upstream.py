@@ -0,0 +1,154 @@
+"""A stand-in for Google Translate and AWS Lambda, for load tests that must
+not reach either of them.
+
+    python bin/fake_upstream.py --port 8002 --latency 80 --error-rate 0.01
+
+It serves ``/translate_a/t`` (``client=t`` and ``client=x``) and
+``/translate_a/single`` (``dj=1``) with made-up translations, after an
+injected latency. Some responses may be errors or CAPTCHA pages instead.
+Lambda invocations (``/2015-03-31/functions/<name>/invocations``) run the
+web proxy of ``lambda/lambda_function.py`` in process, so its requests
+should come back to this server too. Point the app at it with:
+
+    UPSTREAM_BASE_URL=http://localhost:8002 \\
+    AWS_ENDPOINT_URL=http://localhost:8002 \\
+    AWS_ACCESS_KEY_ID=fake AWS_SECRET_ACCESS_KEY=fake \\
+    python application.py
+
+See bin/loadtest.py to send load to the app.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+
+import click
+from flask import Flask, Response, redirect, request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+import lambda_function  # noqa
+
+
+CAPTCHA_PAGE = """<html><head><title>Sorry...</title></head><body>
+Our systems have detected unusual traffic from your computer network.
+</body></html>"""
+
+fake = Flask(__name__)
+fake.config.update(latency=0.0, jitter=0.0, slow_rate=0.0, slow_latency=0.0,
+                   error_rate=0.0, captcha_rate=0.0)
+
+
+def fake_translate(text, target):
+    return [('[{}] {}'.format(target, sentence), sentence)
+            for sentence in text.split('\n') if sentence]
+
+
+def inject():
+    """Sleeps for a while, then returns an error or a CAPTCHA response if
+    one is due, or ``None`` otherwise."""
+    config = fake.config
+    if random.random() < config['slow_rate']:
+        latency = config['slow_latency']
+    else:
+        latency = random.gauss(config['latency'], config['jitter'])
+    time.sleep(max(0, latency) / 1000.0)
+
+    dice = random.random()
+    if dice < config['captcha_rate']:
+        return redirect('/sorry/index?continue=' + request.url)
+    elif dice < config['captcha_rate'] + config['error_rate']:
+        return random.choice(['Internal Server Error',
+                              'Service Unavailable']), \
+            random.choice([500, 503])
+    return None
+
+
+@fake.route('/sorry/index')
+def sorry():
+    return Response(CAPTCHA_PAGE, status=503, mimetype='text/html')
+
+
+@fake.route('/translate_a/t', methods=['GET', 'POST'])
+def translate_t():
+    error = inject()
+    if error is not None:
+        return error
+
+    params = request.values
+    text, source, target = params['text'], params['sl'], params['tl']
+    sentences = fake_translate(text, target)
+
+    if params.get('client') == 't':
+        # Elided elements stand for nulls, as in the real thing
+        body = '[[{}],,"{}"]'.format(
+            ','.join('[{},{},,,3]'.format(json.dumps(trans),
+                                           json.dumps(orig))
+                     for trans, orig in sentences),
+            'en' if source == 'auto' else source)
+        return Response(body, mimetype='text/javascript')
+    else:
+        return Response(json.dumps({
+            'sentences': [{'trans': trans, 'orig': orig, 'backend': 1}
+                          for trans, orig in sentences],
+            'src': source,
+        }), mimetype='application/json')
+
+
+@fake.route('/translate_a/single', methods=['GET', 'POST'])
+def translate_single():
+    error = inject()
+    if error is not None:
+        return error
+
+    params = request.values
+    source = params['sl']
+    sentences = fake_translate(params['q'], params['tl'])
+    return Response(json.dumps({
+        'sentences': [{'trans': trans, 'orig': orig, 'backend': 1}
+                      for trans, orig in sentences],
+        'src': 'en' if source == 'auto' else source,
+        'confidence': 1.0,
+        'ld_result': {'srclangs': [source], 'srclangs_confidences': [1.0]},
+    }), mimetype='application/json')
+
+
+@fake.route('/2015-03-31/functions/<name>/invocations', methods=['POST'])
+def invoke(name):
+    """Runs the web proxy as AWS Lambda would."""
+    event = json.loads(request.get_data(as_text=True) or '{}')
+    headers = {'X-Amz-Executed-Version': '$LATEST'}
+    try:
+        result = lambda_function.lambda_handler(event, None)
+    except Exception as e:
+        headers['X-Amz-Function-Error'] = 'Unhandled'
+        result = {'errorMessage': str(e), 'errorType': type(e).__name__}
+    return Response(json.dumps(result), headers=headers,
+                    mimetype='application/json')
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', type=int, default=8002)
+@click.option('--latency', type=float, default=50.0,
+              help='Mean latency in milliseconds')
+@click.option('--jitter', type=float, default=10.0,
+              help='Standard deviation of the latency in milliseconds')
+@click.option('--slow-rate', type=float, default=0.0,
+              help='Fraction of responses that take --slow-latency')
+@click.option('--slow-latency', type=float, default=2000.0)
+@click.option('--error-rate', type=float, default=0.0,
+              help='Fraction of responses that are HTTP 500 or 503')
+@click.option('--captcha-rate', type=float, default=0.0,
+              help='Fraction of responses redirected to a CAPTCHA page')
+def main(host, port, latency, jitter, slow_rate, slow_latency, error_rate,
+         captcha_rate):
+    fake.config.update(latency=latency, jitter=jitter, slow_rate=slow_rate,
+                       slow_latency=slow_latency, error_rate=error_rate,
+                       captcha_rate=captcha_rate)
+    fake.run(host=host, port=port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Sends load to the translation endpoints and reports throughput and
+latency percentiles for each endpoint and number of concurrent workers.
+
+    python bin/loadtest.py --url http://localhost:8001 --workers 1,4,16
+
+Run it against an app whose upstream is bin/fake_upstream.py so that no
+request reaches Google Translate or AWS Lambda.
+"""
+
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import requests
+
+
+#: Builds the request for each endpoint out of a text
+ENDPOINTS = {
+    'v1.2': lambda text: ('post', '/v1.2/translate', {
+        'data': {'t': text, 'm': '1', 'sl': 'en', 'tl': 'ko'}}),
+    'v1.3': lambda text: ('get', '/api/v1.3/translate', {
+        'params': {'text': text, 'source': 'en', 'target': 'ko'}}),
+}
+
+
+def percentile(samples, p):
+    """Returns the ``p``-th percentile (0-100) of sorted samples."""
+    if not samples:
+        return float('nan')
+    index = min(len(samples) - 1, int(len(samples) * p / 100.0))
+    return samples[index]
+
+
+def run(url, endpoint, workers, count, distinct, timeout):
+    """Sends ``count`` requests with ``workers`` concurrent workers.
+
+    :param distinct: Number of distinct texts to send (i.e., how much the
+                     translation cache may help); ``0`` for all distinct
+    :return: A tuple of the latencies of successful requests (sorted), the
+             number of errors by status code, and the elapsed time
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    counter = itertools.count()
+    nonce = int(time.time() * 1000)
+    lock = threading.Lock()
+    latencies = []
+    errors = {}
+
+    def send(_):
+        with lock:
+            index = next(counter)
+        if distinct:
+            index %= distinct
+        method, path, kwargs = ENDPOINTS[endpoint](
+            'Load test {} {}. How is it going?'.format(nonce, index))
+
+        started_at = time.time()
+        try:
+            resp = session.request(method, url + path, timeout=timeout,
+                                   **kwargs)
+            status = resp.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        latency = time.time() - started_at
+
+        with lock:
+            if status == 200:
+                latencies.append(latency)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+    started_at = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(send, range(count)))
+    elapsed = time.time() - started_at
+
+    return sorted(latencies), errors, elapsed
+
+
+@click.command()
+@click.option('--url', default='http://localhost:8001')
+@click.option('--endpoint', '-e', multiple=True,
+              type=click.Choice(sorted(ENDPOINTS)),
+              default=sorted(ENDPOINTS))
+@click.option('--workers', default='1,4,16',
+              help='Comma-separated numbers of concurrent workers')
+@click.option('--requests', 'count', type=int, default=200,
+              help='Number of requests per endpoint and number of workers')
+@click.option('--distinct', type=int, default=0,
+              help='Number of distinct texts; 0 for all distinct')
+@click.option('--timeout', type=float, default=30.0)
+def main(url, endpoint, workers, count, distinct, timeout):
+    click.echo('{:>8} {:>8} {:>9} {:>8} {:>9} {:>9} {:>9}  {}'.format(
+        'endpoint', 'workers', 'requests', 'req/s', 'p50 (ms)', 'p95 (ms)',
+        'p99 (ms)', 'errors'))
+
+    for name in endpoint:
+        for n in [int(x) for x in workers.split(',')]:
+            latencies, errors, elapsed = run(url.rstrip('/'), name, n, count,
+                                             distinct, timeout)
+            click.echo(
+                '{:>8} {:>8} {:>9} {:>8.1f} {:>9.1f} {:>9.1f} {:>9.1f}  {}'
+                .format(name, n, count, count / elapsed,
+                        percentile(latencies, 50) * 1000,
+                        percentile(latencies, 95) * 1000,
+                        percentile(latencies, 99) * 1000,
+                        ', '.join('{}: {}'.format(k, v)
+                                  for k, v in sorted(errors.items(),
+                                                     key=str)) or '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Replays traffic captured by the app (see the ``capture`` section of
+config.yml.dist) against another instance, and reports throughput and
+latency percentiles for each path.
+
+    python bin/replay.py --url http://staging:8001 --speed 4 \\
+        /tmp/translator-traffic/traffic-*.jsonl
+
+Requests are sent at the pace they were recorded at, ``--speed`` times as
+fast; ``--speed 0`` sends them as fast as ``--workers`` allow. If all
+workers are busy, requests fall behind schedule, which is reported as lag.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import requests
+
+from loadtest import percentile
+
+
+def load(paths):
+    """Reads the records of all capture files, in the order the requests
+    arrived in."""
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    records.sort(key=lambda record: record['timestamp'])
+    return records
+
+
+def replay(url, records, speed, workers, timeout):
+    """Sends the recorded requests on their schedule.
+
+    :return: A tuple of the results by path, each one being a dictionary of
+             sorted ``latencies`` of successful requests, ``errors`` by
+             status code and ``mismatches`` (the number of requests whose
+             status differs from the recorded one); the sorted lags behind
+             schedule; and the elapsed time
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    lock = threading.Lock()
+    results = {}
+    lags = []
+
+    def send(record, due_at):
+        started_at = time.time()
+        try:
+            resp = session.request(
+                record['method'], url + record['path'],
+                params=record['args'], data=record['form'],
+                json=record.get('json'), timeout=timeout)
+            status = resp.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        latency = time.time() - started_at
+
+        with lock:
+            lags.append(max(0, started_at - due_at))
+            result = results.setdefault(record['path'], {
+                'latencies': [], 'errors': {}, 'mismatches': 0})
+            if status == 200:
+                result['latencies'].append(latency)
+            else:
+                result['errors'][status] = \
+                    result['errors'].get(status, 0) + 1
+            if status != record.get('status'):
+                result['mismatches'] += 1
+
+    started_at = time.time()
+    first = records[0]['timestamp'] if records else 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for record in records:
+            due_at = started_at
+            if speed > 0:
+                due_at += (record['timestamp'] - first) / speed
+                delay = due_at - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(send, record, due_at)
+    elapsed = time.time() - started_at
+
+    for result in results.values():
+        result['latencies'].sort()
+    return results, sorted(lags), elapsed
+
+
+@click.command()
+@click.argument('paths', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+@click.option('--url', default='http://localhost:8001')
+@click.option('--speed', type=float, default=1.0,
+              help='How many times as fast as recorded; 0 for no pauses')
+@click.option('--workers', type=int, default=16,
+              help='Number of concurrent workers')
+@click.option('--limit', type=int, default=0,
+              help='Number of requests to replay; 0 for all')
+@click.option('--timeout', type=float, default=30.0)
+def main(paths, url, speed, workers, limit, timeout):
+    records = load(paths)
+    if limit:
+        records = records[:limit]
+    if not records:
+        raise click.ClickException('No requests to replay')
+
+    recorded = records[-1]['timestamp'] - records[0]['timestamp']
+    click.echo('Replaying {} requests recorded over {:.1f} s'.format(
+        len(records), recorded))
+
+    results, lags, elapsed = replay(url.rstrip('/'), records, speed,
+                                    workers, timeout)
+
+    click.echo('{:<28} {:>9} {:>8} {:>9} {:>9} {:>9} {:>10}  {}'.format(
+        'path', 'requests', 'req/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+        'mismatches', 'errors'))
+    for path, result in sorted(results.items()):
+        latencies, errors = result['latencies'], result['errors']
+        count = len(latencies) + sum(errors.values())
+        click.echo(
+            '{:<28} {:>9} {:>8.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>10}  {}'
+            .format(path, count, count / elapsed,
+                    percentile(latencies, 50) * 1000,
+                    percentile(latencies, 95) * 1000,
+                    percentile(latencies, 99) * 1000,
+                    result['mismatches'],
+                    ', '.join('{}: {}'.format(k, v)
+                              for k, v in sorted(errors.items(),
+                                                 key=str)) or '-'))
+
+    click.echo('Sent {} requests in {:.1f} s ({:.1f} req/s); lag behind '
+               'schedule p50 {:.1f} ms, p99 {:.1f} ms'.format(
+                   len(lags), elapsed, len(lags) / elapsed,
+                   percentile(lags, 50) * 1000,
+                   percentile(lags, 99) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,77 @@
-__version__ = '0.1.1'
+__version__ = '0.4.0'
 
-import socket
+import base64
+import gzip
+import io
 
 import requests
 
 
+# Kept at the module level so that warm containers reuse pooled connections
+session = requests.Session()
+
+#: Maximum number of URLs fetched concurrently within an invocation
+MAX_WORKERS = 8
+
+
+def compress(text):
+    """Compresses a text with gzip and encodes it with base64, so that it
+    takes less room in the invocation response."""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(text.encode('utf-8'))
+    return base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+def fetch(request, compressed=False, timeout=None):
+    """Fetches a single URL described by a request dictionary."""
+    url = request['url']
+    params = request.get('params', {})
+    data = request.get('data', {})
+    headers = request.get('headers', {})
+    resp = session.get(url, params=params, data=data, headers=headers,
+                       timeout=timeout)
+
+    if compressed:
+        return {'body': compress(resp.text), 'encoding': 'gzip+base64',
+                'status_code': resp.status_code}
+    else:
+        return {'text': resp.text, 'status_code': resp.status_code}
+
+
+def fetch_safely(request, compressed=False, timeout=None):
+    try:
+        return fetch(request, compressed, timeout)
+    except Exception as e:
+        return {'error': str(e), 'status_code': 502}
+
+
 def lambda_handler(event, context):
-    hostname = socket.gethostbyname(socket.gethostname())
-    print('{}: {}'.format(hostname, event))
-
-    url = event['url']
-    params = event.get('params', {})
-    data = event.get('data', {})
-    headers = event.get('headers', {})
-    resp = requests.get(url, params=params, data=data, headers=headers)
-    return {'text': resp.text, 'status_code': resp.status_code}
+    """Fetches a URL given as ``{'url': ..., 'params': ..., ...}``, or
+    multiple URLs given as ``{'requests': [{'url': ...}, ...]}``. In the
+    latter case, the URLs are fetched concurrently and the responses are
+    returned as ``{'responses': [...]}`` in the same order.
+
+    If the event has ``'compress': True``, each response carries its text
+    as gzip+base64 in ``body`` instead of ``text``. ``'timeout'`` limits how
+    long to wait for each URL, in seconds.
+    """
+    compressed = bool(event.get('compress', False))
+    timeout = event.get('timeout')
+
+    if 'requests' in event:
+        # Python 2.7 runtimes need the futures backport for this (see
+        # requirements.txt); single URLs are fetched without it
+        from concurrent.futures import ThreadPoolExecutor
+
+        reqs = event['requests']
+        print('{} requests'.format(len(reqs)))
+
+        max_workers = max(1, min(MAX_WORKERS, len(reqs)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = executor.map(
+                lambda r: fetch_safely(r, compressed, timeout), reqs)
+            return {'responses': list(responses)}
+
+    print(event['url'])
+    return fetch(event, compressed, timeout)
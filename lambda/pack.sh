@@ -1,2 +1,3 @@
 #!/bin/bash
-zip lambda.zip -r -xi requests lambda_function.py
+# concurrent/ is the futures backport, installed on Python 2.7 only
+zip lambda.zip -r -xi requests $(ls -d concurrent 2>/dev/null) lambda_function.py